@@ -0,0 +1,681 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+# by Liber 118
+# http://liber118.com/
+# licensed under a Creative Commons Attribution-ShareAlike 3.0 Unported License
+# http://creativecommons.org/licenses/by-sa/3.0/
+
+# benchmarks for the game simulation, run as:
+#   python bench.py <name> [<scenario.json>] [<count>]
+
+
+import json
+import multiprocessing
+import os
+import random
+import resource
+import sys
+import time
+
+import pygame
+
+
+######################################################################
+## utility methods
+
+def timed (func, *args):
+    """
+    run a function, returning its result and the elapsed wall time
+    """
+
+    t0 = time.time()
+    result = func(*args)
+
+    return result, time.time() - t0
+
+
+def quietly (func, *args):
+    """
+    run a function with its stdout discarded
+    """
+
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, "w")
+
+    try:
+        return func(*args)
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+
+
+def play_scalar (file_conf, count):
+    """
+    play N games with the scalar engine, returning each end condition
+    """
+
+    sim = pygame.Simulation(file_conf, count)
+    ends = []
+
+    for game, outcome in sim.stream(count, random):
+        ends.append((outcome["end"]["winner"], outcome["end"]["condition"], outcome["n_turn"]))
+
+    return ends
+
+
+def generate_map (width, height):
+    """
+    generate a map config of WIDTH x HEIGHT hexes, in the same layout
+    as the scenario configs: "x,y" keys where x + y is even
+    """
+
+    hexes = {}
+
+    for x in xrange(0, width):
+        for y in xrange(x % 2, 2 * height, 2):
+            site = "NO ACCESS" if (x * 7 + y * 13) % 17 == 0 else "site %d,%d" % (x, y)
+            hexes["%d,%d" % (x, y)] = { "site": site, "force": { "0": 1, "1": 1 }, "has": [] }
+
+    return hexes
+
+
+def scenario_notations (file_conf):
+    """
+    collect every dice notation used in a scenario config
+    """
+
+    with open(file_conf, "r") as f:
+        conf = json.load(f)
+
+    notations = []
+
+    for player in ["player0", "player1"]:
+        for item in conf[player]["conditions"] + conf[player]["cards"]:
+            if item["dice"] not in notations:
+                notations.append(item["dice"])
+
+    return notations
+
+
+######################################################################
+## benchmarks
+
+def bench_dice (file_conf, count=1000000):
+    """
+    scalar vs. batched dice rolls, for the notations in a scenario
+    """
+
+    import vectorized
+
+    dice_list = map(pygame.compile_dice, scenario_notations(file_conf))
+    n = count / len(dice_list)
+
+    def scalar ():
+        for dice in dice_list:
+            roll = dice.roll
+
+            for i in xrange(0, n):
+                roll()
+
+    def batched ():
+        rng = vectorized.make_rng(118)
+
+        for dice in dice_list:
+            vectorized.roll_batch(dice, n, rng)
+
+    _, t_scalar = timed(scalar)
+    _, t_batch = timed(batched)
+
+    print "dice rolls", n * len(dice_list)
+    print "scalar  %.3f sec  %.0f rolls/sec" % (t_scalar, n * len(dice_list) / t_scalar)
+    print "batched %.3f sec  %.0f rolls/sec" % (t_batch, n * len(dice_list) / t_batch)
+    print "speedup %.1fx" % (t_scalar / t_batch)
+
+
+def bench_lockstep (file_conf, count=100000):
+    """
+    scalar vs. lockstep engine, comparing throughput and statistics
+    """
+
+    import vectorized
+
+    n_scalar = max(1, count / 50)
+    ends, t_scalar = timed(quietly, play_scalar, file_conf, n_scalar)
+    pop, t_vector = timed(lambda: vectorized.Population(file_conf, count, vectorized.make_rng(118)).run())
+
+    founders = pop.side[pop.FOUNDER]
+    report = pop.report()
+
+    print "engine     games  games/sec  founders_win  stalemate  mean_turns"
+
+    print "scalar  %8d  %9.0f  %12.4f  %9.4f  %10.2f" % (
+        n_scalar, n_scalar / t_scalar,
+        len([e for e in ends if e[0] == founders]) / float(n_scalar),
+        len([e for e in ends if e[1] == "stalemate"]) / float(n_scalar),
+        sum([e[2] for e in ends]) / float(n_scalar))
+
+    print "lockstep %7d  %9.0f  %12.4f  %9.4f  %10.2f" % (
+        count, count / t_vector,
+        report["win_tally"][pop.index[pop.FOUNDER]] / float(count),
+        report["end_tally"].get("stalemate", 0) / float(count),
+        report["mean_turns"])
+
+    print "speedup %.1fx" % ((count / t_vector) / (n_scalar / t_scalar))
+
+
+def bench_parallel (file_conf, count=20000):
+    """
+    scaling of the multi-process simulation from 1 to N cores
+    """
+
+    n_cpu = multiprocessing.cpu_count()
+    workers = [1]
+
+    while workers[-1] * 2 <= n_cpu:
+        workers.append(workers[-1] * 2)
+
+    if workers[-1] != n_cpu:
+        workers.append(n_cpu)
+
+    print "workers  games/sec  speedup  efficiency"
+
+    for n in workers:
+        sim = pygame.Simulation(file_conf, count, seed=118, workers=n)
+        _, elapsed = timed(quietly, sim.simulate)
+
+        if n == 1:
+            base = elapsed
+
+        print "%7d  %9.0f  %6.2fx  %9.2f" % (n, count / elapsed, base / elapsed, base / elapsed / n)
+
+
+def bench_construct (file_conf, count=5000):
+    """
+    games/sec when each game loads the scenario config, vs. a Scenario compiled once
+    """
+
+    sim = pygame.Simulation(file_conf, count)
+
+    def construct (scenario):
+        for i in xrange(0, count):
+            pygame.Game(scenario, sim)
+
+    def play (scenario):
+        for i in xrange(0, count):
+            for game, outcome in pygame.Game(scenario, sim):
+                pass
+
+    print "construct          games/sec"
+
+    for label, scenario in [("load per game", file_conf), ("scenario once", sim.scenario)]:
+        _, t_construct = timed(construct, scenario)
+        _, t_play = timed(quietly, play, scenario)
+
+        print "%-14s %9.0f built  %9.0f played" % (label, count / t_construct, count / t_play)
+
+
+def bench_deck (file_conf, count=1000):
+    """
+    drawing N cards from decks of 10^2 to 10^6 cards, list vs. Deck
+    """
+
+    cards = [pygame.make_card(c) for c in pygame.load_scenario(file_conf).conf["player0"]["cards"]]
+    rng = random.Random(118)
+
+    def list_draws (deck, n):
+        for i in xrange(0, n):
+            card = rng.choice(deck)
+
+            if not card.retry:
+                deck.remove(card)
+
+    def deck_draws (deck, n):
+        for i in xrange(0, n):
+            deck.draw(rng)
+
+    print "deck_size  list_usec  deck_usec  speedup"
+
+    for k in range(2, 7):
+        size = 10 ** k
+        n = min(count, size)
+        deck = [cards[i % len(cards)] for i in xrange(0, size)]
+
+        _, t_list = timed(list_draws, list(deck), n)
+        _, t_deck = timed(deck_draws, pygame.Deck(deck), n)
+
+        print "%9d  %9.3f  %9.3f  %6.1fx" % (size, t_list / n * 1e6, t_deck / n * 1e6, t_list / t_deck)
+
+
+class MetaState:
+    """
+    stand-in for the former layout of a player's state: a per-game copy
+    of the config, with the counters kept in that same dict
+    """
+
+    FINGERPRINT = ["n_forces", "n_captive", "n_reserve", "n_deployed", "n_casualty", "rage", "init_force"]
+
+
+    def __init__ (self, meta, init_force, rage=0.0):
+        self.__dict__.update(meta)
+        self.init_force = init_force
+        self.n_forces = init_force
+        self.n_deployed = init_force
+        self.n_captive = 0
+        self.n_reserve = 0
+        self.n_casualty = 0
+        self.rage = rage
+
+
+    def fingerprint (self):
+        return tuple([self.__dict__[field] for field in self.FINGERPRINT])
+
+
+    def values (self):
+        return (self.init_force, self.n_forces, self.n_deployed, self.n_captive, self.n_reserve, self.n_casualty, self.rage)
+
+
+    def set_reserve (self, n_reserve):
+        self.n_reserve = min(n_reserve, self.n_forces)
+        self.n_deployed = self.n_forces - self.n_reserve
+
+
+    def to_dict (self):
+        return self.__dict__
+
+
+def bench_state (file_conf, count=2000, reps=15):
+    """
+    per-game memory, and time per turn over N real games, for the
+    slotted PlayerState vs. the former layout, interleaving the runs
+    and keeping the best of each
+    """
+
+    scenario = pygame.load_scenario(file_conf)
+    meta = scenario.players["player0"]["meta"]
+    layouts = [("meta dict", lambda init_force, rage=0.0: MetaState(meta, init_force, rage)), ("PlayerState", pygame.PlayerState)]
+    best = {}
+    n_turns = {}
+
+    def play (layout):
+        # every game replays the same seeds, so both layouts play the same turns
+        sim = pygame.Simulation(scenario, count, events="off")
+        sim.play(count, random.Random(118))
+
+        return sum([n_turn * n for n_turn, n in enumerate(sim.stats.turns)])
+
+    try:
+        for rep in xrange(0, reps):
+            for label, layout in layouts:
+                pygame.PlayerState = layout
+                n_turns[label], elapsed = timed(play, layout)
+                best[label] = min(best.get(label, elapsed), elapsed)
+    finally:
+        pygame.PlayerState = layouts[-1][1]
+
+    # per-game bytes: everything reachable from the state, except what
+    # the scenario config shares across games
+
+    shared = set()
+    deep_size(scenario.conf, shared)
+    deep_size(meta, shared)
+
+    sizes = {
+        "meta dict": deep_size(MetaState(meta, 1000.0).__dict__, set(shared)),
+        "PlayerState": deep_size(pygame.PlayerState(1000.0), set(shared)),
+        }
+
+    print "layout       bytes/player  usec/turn  usec/game"
+
+    for label, layout in layouts:
+        print "%-11s  %12d  %9.3f  %9.2f" % (label, sizes[label], best[label] / n_turns[label] * 1e6, best[label] / count * 1e6)
+
+
+def bench_map (file_conf, count=10000):
+    """
+    counting a player's forces: walking the map vs. incremental totals
+    """
+
+    print "hexes  walk_usec  total_usec"
+
+    for width in [6, 32, 100]:
+        conf = generate_map(width, width)
+        forces = pygame.MapForces(pygame.HexMap(conf))
+
+        def walk ():
+            for i in xrange(0, count):
+                n_forces = 0
+
+                for geo, hex in conf.items():
+                    n_forces += hex["force"]["0"]
+
+        def total ():
+            for i in xrange(0, count):
+                forces.total("0")
+
+        _, t_walk = timed(walk)
+        _, t_total = timed(total)
+
+        print "%5d  %9.3f  %10.3f" % (len(conf), t_walk / count * 1e6, t_total / count * 1e6)
+
+
+def bench_moves (file_conf, count=10000):
+    """
+    legal moves on a generated 100x100 map: parsing coordinates per
+    check vs. the precomputed tables, plus reachability within K moves
+    """
+
+    conf = generate_map(100, 100)
+    hexmap, t_build = timed(pygame.HexMap, conf)
+    geos = hexmap.geos
+    rng = random.Random(118)
+    pairs = []
+
+    while len(pairs) < count:
+        i = rng.randrange(0, len(geos))
+
+        if hexmap.neighbors[i]:
+            pairs.append((i, rng.choice(hexmap.neighbors[i])))
+
+    def parsed ():
+        for i, j in pairs:
+            x0, y0 = map(int, geos[i].split(","))
+            x1, y1 = map(int, geos[j].split(","))
+            (abs(x0 - x1) == abs(y0 - y1)) or ((x0 == x1) and (abs(y0 - y1) == 2))
+
+    def tabled ():
+        moves = hexmap.moves
+
+        for i, j in pairs:
+            j in moves[i]
+
+    _, t_parsed = timed(parsed)
+    _, t_tabled = timed(tabled)
+
+    print "hexes %d  tables built in %.3f sec" % (len(hexmap), t_build)
+    print "parse per check  %7.3f usec/move" % (t_parsed / count * 1e6)
+    print "move table       %7.3f usec/move" % (t_tabled / count * 1e6)
+    print "speedup %.1fx" % (t_parsed / t_tabled)
+    print
+    print "  k  reached  msec/query"
+
+    n = max(1, count / 100)
+    sources = [rng.randrange(0, len(geos)) for i in xrange(0, n)]
+
+    for k in [1, 2, 5, 10, 50]:
+        reach, elapsed = timed(lambda: [hexmap.reachable([i], k) for i in sources])
+        print "%3d  %7.0f  %10.3f" % (k, sum(map(len, reach)) / float(n), elapsed / n * 1e3)
+
+
+def bench_stream (file_conf, count=100000):
+    """
+    streaming N games, per-turn vs. final outcomes only, with the
+    growth in peak memory over the run
+    """
+
+    sim = pygame.Simulation(file_conf, count, events="off")
+
+    def stream (final_only):
+        for game, outcome in sim.stream(count, random.Random(118), final_only):
+            pass
+
+    print "outcomes    games/sec  peak_rss_kb"
+
+    for label, final_only in [("per turn", False), ("final only", True)]:
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        _, elapsed = timed(quietly, stream, final_only)
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss
+
+        print "%-10s %10.0f  %11d" % (label, count / elapsed, rss)
+
+
+def long_scenario (file_conf, max_turns=100):
+    """
+    a variant of a scenario whose games run for MAX_TURNS: no end
+    conditions, and each side plays a mild conversion card every turn
+    """
+
+    with open(file_conf, "r") as f:
+        conf = json.load(f)
+
+    conf["max_turns"] = max_turns
+
+    for player in ["player0", "player1"]:
+        conf[player]["conditions"] = []
+        conf[player]["cards"] = [{ "kind": "ConversionCard", "event": "converted", "dice": "d10/100, >0", "num": 1, "retry": "True" }]
+
+    return pygame.Scenario(conf)
+
+
+def deep_size (obj, seen=None):
+    """
+    bytes held by an object and everything it references, counting
+    each shared object once
+    """
+
+    if seen is None:
+        seen = set()
+
+    if id(obj) in seen:
+        return 0
+
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+
+    if isinstance(obj, dict):
+        size += sum([deep_size(k, seen) + deep_size(v, seen) for k, v in obj.iteritems()])
+    elif isinstance(obj, (list, tuple)):
+        size += sum([deep_size(item, seen) for item in obj])
+    elif hasattr(obj, "__slots__"):
+        size += sum([deep_size(getattr(obj, field), seen) for field in obj.__slots__ if hasattr(obj, field)])
+
+    return size
+
+
+def bench_outcomes (file_conf, count=1000):
+    """
+    keeping every per-turn outcome of N 100-turn games: full copies
+    vs. deltas, with the memory projected out to 100k games
+    """
+
+    scenario = long_scenario(file_conf)
+    sim = pygame.Simulation(scenario, count, events="off")
+
+    def keep (method):
+        rng = random.Random(118)
+        kept = []
+
+        for i in xrange(0, count):
+            game = pygame.Game(scenario, sim, rng, pygame.EventLog(i, "off"))
+
+            while not game.outcome["game_over"]:
+                kept.append(method(game))
+
+        return kept
+
+    def copies (game):
+        game.advance()
+        return game.materialize()
+
+    def deltas (game):
+        return game.play_duplex()
+
+    print "outcomes   turns  turns/sec  bytes/turn  MB per 100k games"
+
+    for label, method in [("copies", copies), ("deltas", deltas)]:
+        kept, elapsed = timed(quietly, keep, method)
+
+        # the config strings are shared with the scenario, not per turn
+        seen = set([id(v) for conf in scenario.players.values() for v in conf["meta"].itervalues()])
+        seen.update([id(k) for k in scenario.players["player0"]["meta"]])
+        per_turn = deep_size(kept, seen) / float(len(kept))
+
+        print "%-7s %8d  %9.0f  %10.0f  %17.0f" % (label, len(kept), len(kept) / elapsed, per_turn, per_turn * len(kept) / count * 100000 / 2 ** 20)
+
+
+def bench_adaptive (file_conf, count=100000):
+    """
+    a fixed run of N games vs. early stopping at a few target
+    half-widths on the founders' win rate, capped at N games
+    """
+
+    print "half_width   games      sec  win_rate"
+
+    for half_width in [None, 0.02, 0.01, 0.005]:
+        sim = pygame.Simulation(file_conf, count, seed=118, events="off", half_width=half_width)
+        _, elapsed = timed(sim.simulate)
+        rate, low, high = sim.stats.win_rate()
+
+        print "%10s  %6d  %7.2f  %.4f [%.4f, %.4f]" % (half_width or "fixed", sim.stats.games, elapsed, rate, low, high)
+
+
+def bench_spans (file_conf, count=100):
+    """
+    best-span queries and win checks on a 19x19 tic-tac-toe board with
+    span_length 5, over a game of N random moves: scanning every span,
+    vs. the per-span counters, vs. bitboards
+    """
+
+    import tic_tac_toe
+
+    rng = random.Random(118)
+    cells = range(0, 19 ** 2)
+    rng.shuffle(cells)
+    moves = cells[:count]
+
+    def play (t3, query):
+        t3.board = [t3.BLANK] * t3.max_index
+        t3.sync_board()
+
+        for n, i in enumerate(moves):
+            t3.board[i] = [t3.X_MARK, t3.O_MARK][n % 2]
+            query(t3.X_MARK)
+            query(t3.O_MARK)
+
+    def wins (t3, won):
+        for i in xrange(0, count):
+            won(t3.X_MARK)
+
+    print "engine    query_msec  win_msec"
+
+    for label, board_class, method in [("scan", tic_tac_toe.SpanBoard, "scan_best_span"), ("counters", tic_tac_toe.SpanBoard, "get_best_span"), ("bitboard", tic_tac_toe.BitBoard, "get_best_span")]:
+        t3 = tic_tac_toe.TicTacToe(board_size=19, span_length=5, log_file=os.devnull, board_class=board_class)
+        _, t_query = timed(play, t3, getattr(t3, method))
+
+        if method == "scan_best_span":
+            won = lambda mark: t3.scan_best_span(mark)[0] == t3.span_length
+        else:
+            won = t3.board.won
+
+        _, t_win = timed(wins, t3, won)
+
+        print "%-8s  %10.3f  %8.4f" % (label, t_query / count / 2 * 1e3, t_win / count * 1e3)
+
+
+def bench_search (file_conf, count=20):
+    """
+    self-play with the search AI under its time budget, for up to N
+    moves per game: nodes/sec, transposition table hit rate, depth
+    reached, and time per move
+    """
+
+    import tic_tac_toe
+
+    print "board  span  moves  nodes/sec  hit_rate  mean_depth  mean_msec  max_msec"
+
+    for board_size, span_length in [(3, 3), (7, 4), (11, 5), (15, 5)]:
+        t3 = tic_tac_toe.TicTacToe(board_size=board_size, span_length=span_length, log_file=os.devnull, ai_class=tic_tac_toe.SearchAI)
+        ai = t3.ai
+        marks = [t3.X_MARK, t3.O_MARK]
+        elapsed = []
+        depths = []
+        nodes = probes = hits = 0
+
+        for n in xrange(0, min(count, t3.max_index)):
+            move, t_move = timed(ai.search, marks[n % 2], t3)
+            elapsed.append(t_move)
+            depths.append(ai.depth)
+            nodes += ai.nodes
+            probes += ai.probes
+            hits += ai.hits
+            t3.board[move] = marks[n % 2]
+
+            if t3.board.won(marks[n % 2]):
+                break
+
+        print "%5d  %4d  %5d  %9.0f  %8.3f  %10.1f  %9.1f  %8.1f" % (
+            board_size, span_length, len(elapsed), nodes / sum(elapsed), hits / float(max(1, probes)),
+            sum(depths) / float(len(depths)), sum(elapsed) / len(elapsed) * 1e3, max(elapsed) * 1e3)
+
+
+def bench_symmetry (file_conf, count=3):
+    """
+    search AI analysis of every distinct position on a 3x3 board with
+    up to N marks, with the position cache cleared before each search, vs. kept
+    across searches so that rotations and reflections become cache hits
+    """
+
+    import tic_tac_toe
+
+    t3 = tic_tac_toe.TicTacToe(log_file=os.devnull, ai_class=tic_tac_toe.SearchAI)
+    marks = [t3.X_MARK, t3.O_MARK]
+    positions = [[t3.BLANK] * t3.max_index]
+    layer = positions
+
+    for n in xrange(0, count):
+        layer = sorted(set([tuple(board[:i]) + (marks[n % 2],) + tuple(board[i + 1:]) for board in layer for i in xrange(0, t3.max_index) if board[i] == t3.BLANK]))
+        layer = map(list, layer)
+        positions.extend(layer)
+
+    def analyze (ai, clear):
+        for board in positions:
+            t3.board = board
+            ai.search(marks[(t3.max_index - board.count(t3.BLANK)) % 2], t3)
+
+            if clear:
+                ai.cache.memo.clear()
+
+    print "cache      positions  searches  msec  speedup"
+
+    baseline = None
+
+    for label, clear in [("cleared", True), ("kept", False)]:
+        ai = t3.ai = tic_tac_toe.SearchAI()
+        _, elapsed = timed(analyze, ai, clear)
+        baseline = baseline or elapsed
+
+        print "%-9s  %9d  %8d  %4.0f  %7.2f" % (label, len(positions), ai.cache.misses, elapsed * 1e3, baseline / elapsed)
+
+
+BENCHMARKS = {
+    "adaptive": bench_adaptive,
+    "construct": bench_construct,
+    "deck": bench_deck,
+    "dice": bench_dice,
+    "lockstep": bench_lockstep,
+    "map": bench_map,
+    "moves": bench_moves,
+    "outcomes": bench_outcomes,
+    "parallel": bench_parallel,
+    "search": bench_search,
+    "spans": bench_spans,
+    "state": bench_state,
+    "stream": bench_stream,
+    "symmetry": bench_symmetry,
+    }
+
+
+######################################################################
+## command line interface
+
+if __name__ == "__main__":
+    if (len(sys.argv) < 2) or (sys.argv[1] not in BENCHMARKS):
+        print "usage: bench.py [%s] [<scenario.json>] [<count>]" % "|".join(sorted(BENCHMARKS))
+        sys.exit(1)
+
+    args = [sys.argv[2] if len(sys.argv) > 2 else "tboo.json"]
+
+    if len(sys.argv) > 3:
+        args.append(int(sys.argv[3]))
+
+    BENCHMARKS[sys.argv[1]](*args)
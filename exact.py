@@ -0,0 +1,451 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+# by Liber 118
+# http://liber118.com/
+# licensed under a Creative Commons Attribution-ShareAlike 3.0 Unported License
+# http://creativecommons.org/licenses/by-sa/3.0/
+
+# exact outcome probabilities for small scenarios, run as:
+#   python exact.py [options] <scenario.json>
+
+
+import collections
+import json
+import optparse
+import sys
+import time
+import unittest
+
+import pygame
+
+
+######################################################################
+## exact solver
+
+class FaceRNG:
+    """
+    stand-in for the roll RNG, which rolls a given face of the die and
+    records the size of the die -- every kind the Solver supports rolls
+    at most once per step of play, and makes no other random choices
+    """
+
+    def __init__ (self):
+        self.reset(0)
+
+
+    def reset (self, face):
+        self.face = face
+        self.die_count = None
+
+
+    def randint (self, a, b):
+        self.die_count = b - a
+        return a + self.face
+
+
+class Solver:
+    """
+    exact win probabilities for a scenario, by memoized dynamic
+    programming over the Markov chain of game states
+
+    the rules come from the Card and Condition classes themselves: each
+    step of a turn (as in Game.attempt_turn) gets executed on a working
+    Game once per card in the deck and per face of the die, and the
+    resulting states deduplicated, so a state's value is the expected
+    value over the states at the start of the next turn
+
+    a state holds, per player, the counters which the rules read plus
+    the number of quiet turns and the deck as counts per card -- but
+    not n_casualty: it only feeds the fingerprints for PreventDraw,
+    and its window never matches on a fingerprint, since it starts with
+    two None sentinels and keeps its first len_stalemate entries;
+    whether the window is empty (len_stalemate 0) is part of the state
+
+    the memo holds up to CACHE_SIZE values, evicting the least recently used
+
+    only the card and condition kinds in KINDS are supported: the state
+    leaves out the forces per hex, so e.g. a MovementCard cannot be
+    solved exactly
+    """
+
+    KINDS = ["PreventDraw", "SimulateJail", "SimulateHospital", "ForceReductionCard", "InsurrectionCard", "ConversionCard", "SeriouslyWeirdCard", "WinningPlayCard"]
+
+    def __init__ (self, scenario, cache_size=1000000):
+        if isinstance(scenario, basestring):
+            scenario = pygame.load_scenario(scenario)
+
+        for player in pygame.Scenario.PLAYERS:
+            for conf in scenario.conf[player]["cards"] + scenario.conf[player]["conditions"]:
+                if conf["kind"] not in self.KINDS:
+                    raise ValueError("the exact solver does not support %s" % conf["kind"])
+
+        self.scenario = scenario
+        self.cache_size = cache_size
+        self.memo = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self.rng = FaceRNG()
+        self.game = pygame.Game(scenario, None, self.rng, pygame.EventLog(0, "off"))
+        self.players = [self.game.founder, self.game.fellows]
+        self.sides = dict([(player.meta["side"], player.side) for player in self.players])
+
+        for player in self.players:
+            player.draw_rng = player.roll_rng = self.rng
+
+        # the distinct cards in each deck, in order of first appearance
+
+        self.cards = []
+
+        for player in self.players:
+            cards = []
+
+            for card in player.deck.cards:
+                if card not in cards:
+                    cards.append(card)
+
+            self.cards.append(cards)
+
+        # the steps of a turn, cf. Game.attempt_turn()
+
+        founder, fellows = self.players
+        self.steps = [("card", founder), ("card", fellows)]
+        self.steps.extend([("condition", fellows, cond) for cond in fellows.conditions])
+        self.steps.extend([("condition", founder, cond) for cond in founder.conditions])
+
+        self.start = self.initial_state()
+
+
+    def initial_state (self):
+        """
+        the state at the start of the first turn, read from the working
+        game before any play
+        """
+
+        players = []
+
+        for player, cards in zip(self.players, self.cards):
+            state = player.state
+            counts = tuple([player.deck.cards.count(card) for card in cards])
+            players.append((state.n_forces, state.n_captive, state.n_reserve, state.n_deployed, state.rage, player.n_quiet, player.n_events, counts))
+
+        return (1, None in self.game.last_full_meta, tuple(players))
+
+
+    def restore (self, state):
+        """
+        load a state into the working game
+        """
+
+        n_turn, sentinels, players = state
+
+        self.game.outcome["n_turn"] = n_turn
+        self.game.last_full_meta = [None, None] if sentinels else []
+
+        for player, values in zip(self.players, players):
+            s = player.state
+            (s.n_forces, s.n_captive, s.n_reserve, s.n_deployed, s.rage, player.n_quiet, player.n_events, counts) = values
+            s.n_casualty = 0
+
+
+    def capture (self, counts):
+        """
+        the state of the working game, given the deck counts
+        """
+
+        players = []
+
+        for player, c in zip(self.players, counts):
+            s = player.state
+            players.append((s.n_forces, s.n_captive, s.n_reserve, s.n_deployed, s.rage, player.n_quiet, player.n_events, c))
+
+        return (self.game.outcome["n_turn"], None in self.game.last_full_meta, tuple(players))
+
+
+    def run_step (self, state, counts, func):
+        """
+        execute one step of play from a state, once per face of the die
+        if it rolls, yielding each (probability, resulting state or end)
+        """
+
+        face = 0
+        die_count = 0
+
+        while face <= die_count:
+            self.restore(state)
+            self.rng.reset(face)
+
+            try:
+                func()
+                result = self.capture(counts)
+            except pygame.GameOverException, ex:
+                end = ex.value
+                result = (self.sides[end["winner"]], end["condition"], end["margin"], state[0])
+
+            if self.rng.die_count is None:
+                yield 1.0, result
+                return
+
+            die_count = self.rng.die_count
+            yield 1.0 / (die_count + 1), result
+            face += 1
+
+
+    def transitions (self, state):
+        """
+        the distributions over the states at the start of the next turn,
+        and over the ends of the game during this turn
+        """
+
+        ends = collections.defaultdict(float)
+        n_turn = state[0]
+
+        if n_turn > self.game.outcome["max_turns"]:
+            for p, end in self.run_step(state, None, self.game.conclude):
+                ends[end] += p
+
+            return {}, ends
+
+        # start the turn
+
+        players = tuple([values[:5] + (values[5] + 1, 0, values[7]) for values in state[2]])
+        layer = { (n_turn, state[1], players): 1.0 }
+
+        for step in self.steps:
+            next_layer = collections.defaultdict(float)
+
+            for mid, p_mid in layer.iteritems():
+                for p, result in self.expand(step, mid):
+                    if len(result) == 4:
+                        ends[result] += p_mid * p
+                    else:
+                        next_layer[result] += p_mid * p
+
+            layer = next_layer
+
+        # advance to the next turn
+
+        states = collections.defaultdict(float)
+
+        for (n_turn, sentinels, players), p in layer.iteritems():
+            players = tuple([values[:6] + (0, values[7]) for values in players])
+            states[(n_turn + 1, sentinels, players)] += p
+
+        return states, ends
+
+
+    def expand (self, step, state):
+        """
+        the distribution over the results of one step of a turn
+        """
+
+        counts = [values[7] for values in state[2]]
+
+        if step[0] == "card":
+            player = step[1]
+            deck = counts[player.side]
+            size = float(sum(deck))
+
+            if size == 0:
+                yield 1.0, state
+                return
+
+            for i, card in enumerate(self.cards[player.side]):
+                if deck[i] > 0:
+                    drawn = list(counts)
+
+                    if not card.retry:
+                        drawn[player.side] = deck[:i] + (deck[i] - 1,) + deck[i + 1:]
+
+                    func = lambda: card.execute(self.game, player, player.opponent)
+
+                    for p, result in self.run_step(state, tuple(drawn), func):
+                        yield deck[i] / size * p, result
+        else:
+            player, cond = step[1], step[2]
+            func = lambda: cond.execute(self.game, player, player.opponent)
+
+            for p, result in self.run_step(state, tuple(counts), func):
+                yield p, result
+
+
+    def value (self, state):
+        """
+        the outcome distribution from a state, as a dict of (winner
+        index, end condition) -> probability, and the expected number
+        of turns and winning margin
+        """
+
+        value = self.memo.get(state)
+
+        if value is not None:
+            self.hits += 1
+            self.memo[state] = self.memo.pop(state)
+            return value
+
+        self.misses += 1
+        probs = collections.defaultdict(float)
+        n_turns = 0.0
+        margin = 0.0
+
+        states, ends = self.transitions(state)
+
+        for (winner, condition, m, n_turn), p in ends.iteritems():
+            probs[(winner, condition)] += p
+            n_turns += p * n_turn
+            margin += p * m
+
+        for next_state, p in states.iteritems():
+            next_probs, next_turns, next_margin = self.value(next_state)
+
+            for key, q in next_probs.iteritems():
+                probs[key] += p * q
+
+            n_turns += p * next_turns
+            margin += p * next_margin
+
+        value = (dict(probs), n_turns, margin)
+        self.memo[state] = value
+
+        if len(self.memo) > self.cache_size:
+            self.memo.popitem(last=False)
+            self.evictions += 1
+
+        return value
+
+
+    def solve (self):
+        """
+        the outcome distribution of the scenario
+        """
+
+        return self.value(self.start)
+
+
+    def win_rate (self, index="0"):
+        """
+        the exact probability of a win for a player
+        """
+
+        probs, n_turns, margin = self.solve()
+
+        return sum([p for (winner, condition), p in probs.items() if winner == int(index)])
+
+
+def cross_check (scenario, max_iterations, seed=None, cache_size=1000000):
+    """
+    compare the exact win rate for the founders with a Monte Carlo
+    estimate, returning the exact rate and the estimate with its interval
+    """
+
+    solver = Solver(scenario, cache_size)
+    sim = pygame.Simulation(solver.scenario, max_iterations, seed=seed, events="off")
+    sim.simulate()
+
+    return solver.win_rate(), sim.stats.win_rate()
+
+
+######################################################################
+## unit tests
+
+class TestSolver (unittest.TestCase):
+    """unit tests for the exact solver"""
+
+    def small_scenario (self):
+        with open("tboo.json", "r") as f:
+            conf = json.load(f)
+
+        # the first two cards of each deck, once each
+
+        for player in ["player0", "player1"]:
+            conf[player]["cards"] = conf[player]["cards"][:2]
+
+            for card in conf[player]["cards"]:
+                card["num"] = 1
+
+        return pygame.Scenario(conf)
+
+
+    def test_distribution (self):
+        """the outcome probabilities sum to one, over end conditions the rules allow"""
+
+        solver = Solver(self.small_scenario())
+        probs, n_turns, margin = solver.solve()
+
+        self.assertEqual(solver.solve(), (probs, n_turns, margin))
+        self.assertAlmostEqual(sum(probs.values()), 1.0)
+        self.assertTrue(set([condition for winner, condition in probs]) <= set(["overwhelmed opponents", "stalemate", "status quo", "both ran out of cards"]))
+        self.assertTrue(1.0 <= n_turns <= 10.0)
+
+
+    def test_bounded_cache (self):
+        """a memo smaller than the set of states gives the same answer"""
+
+        scenario = self.small_scenario()
+        solver = Solver(scenario)
+        bounded = Solver(scenario, cache_size=100)
+
+        self.assertAlmostEqual(bounded.win_rate(), solver.win_rate())
+        self.assertTrue(bounded.evictions > 0)
+        self.assertTrue(len(bounded.memo) <= 100)
+
+
+    def test_cross_check (self):
+        """the exact win rate falls within the Monte Carlo estimate"""
+
+        exact, (rate, low, high) = cross_check(self.small_scenario(), 4000, seed=118)
+        half_width = (high - low) / 2.0
+
+        self.assertTrue(abs(exact - rate) < 2.0 * half_width)
+
+
+    def test_unsupported (self):
+        """a scenario with a card outside the solver's state gets rejected"""
+
+        conf = self.small_scenario().conf
+        conf["player1"]["cards"].append({ "kind": "MovementCard", "event": "march", "dice": "d10/10, >0", "num": 1, "retry": "False" })
+
+        self.assertRaises(ValueError, Solver, pygame.Scenario(conf))
+
+
+######################################################################
+## command line interface
+
+if __name__ == "__main__":
+    if (len(sys.argv) > 1) and (sys.argv[1] == "test"):
+        # run unit tests
+        del sys.argv[1]
+        unittest.main()
+
+    parser = optparse.OptionParser(usage="%prog [options] <scenario.json>")
+    parser.add_option("--cache-size", type="int", default=1000000, help="maximum number of states in the memo")
+    parser.add_option("--check", type="int", default=0, help="cross-check against a Monte Carlo run of this many games")
+    parser.add_option("--seed", type="int", default=None, help="master seed for the Monte Carlo run")
+
+    (options, args) = parser.parse_args()
+
+    if len(args) != 1:
+        parser.error("expected a scenario config")
+
+    solver = Solver(args[0], options.cache_size)
+
+    t0 = time.time()
+    probs, n_turns, margin = solver.solve()
+    elapsed = time.time() - t0
+
+    print solver.win_rate("0")
+
+    for (winner, condition), p in sorted(probs.items()):
+        print "%d %s %.6f" % (winner, condition, p)
+
+    print "mean_turns %.4f" % n_turns
+    print "margin %.4f" % margin
+    print "states %d  memo hits %d  evictions %d  %.2f sec" % (solver.misses, solver.hits, solver.evictions, elapsed)
+
+    if options.check:
+        sim = pygame.Simulation(solver.scenario, options.check, seed=options.seed, events="off")
+        sim.simulate()
+
+        print "monte carlo %d games  win_rate %.4f [%.4f, %.4f]" % ((options.check,) + sim.stats.win_rate())
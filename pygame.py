@@ -7,57 +7,540 @@
 # http://creativecommons.org/licenses/by-sa/3.0/
 
 
+import array
+import atexit
+import collections
+import itertools
 import json
+import math
+import multiprocessing
+import operator
+import optparse
+import os
 import random
 import re
 import sys
-import uuid
+import unittest
 
 
 ######################################################################
 ## global variables and utility methods
       
-debug = True # False
+class Tracer:
+    """
+    structured tracing, enabled per category
+
+    each category is a plain attribute, so a disabled tracepoint costs
+    one attribute test:
+
+        if trace.forces:
+            trace.emit("forces", ...)
+
+    enabled output gets buffered, then written in batches to a file,
+    or else kept in the in-memory collector
+    """
+
+    CATEGORIES = ["cards", "forces", "conditions", "turns"]
+
+
+    def __init__ (self, batch_size=1024):
+        self.batch_size = batch_size
+        self.fd = None
+        self.lines = []
+        self.collected = []
+        self.enable([])
+
+
+    def enable (self, categories, path=None):
+        """
+        enable the given categories, tracing to a file or else in memory
+        """
+
+        for category in categories:
+            if category not in self.CATEGORIES:
+                raise ValueError("unknown trace category: %s" % repr(category))
+
+        for category in self.CATEGORIES:
+            setattr(self, category, category in categories)
+
+        self.close()
+
+        if path:
+            # each batch gets appended with a single write, so worker
+            # processes can share the file
+            self.fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | os.O_APPEND, 0644)
+
+
+    def emit (self, category, *fields):
+        """
+        record one trace line
+        """
+
+        self.lines.append(category + "\t" + " ".join(map(str, fields)))
+
+        if len(self.lines) >= self.batch_size:
+            self.flush()
+
+
+    def flush (self):
+        """
+        write out the buffered trace lines
+        """
+
+        if self.lines:
+            if self.fd is not None:
+                os.write(self.fd, "\n".join(self.lines) + "\n")
+            else:
+                self.collected.extend(self.lines)
+
+            self.lines = []
+
+
+    def close (self):
+        self.flush()
+
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+trace = Tracer()
+atexit.register(trace.close)
+
+_geo_cache = {}
+
+def parse_geo (geo):
+    """
+    parse "x,y" hex coordinates, once per distinct string
+    """
+
+    xy = _geo_cache.get(geo)
+
+    if xy is None:
+        x, y = geo.split(",")
+        xy = (int(x), int(y))
+        _geo_cache[geo] = xy
+
+    return xy
+
 
 def verify_move (pt0, pt1):
     """
     verify that a move from one hex to another is valid
     """
 
-    (x0, y0) = map(lambda x: int(x), pt0.split(","))
-    (x1, y1) = map(lambda x: int(x), pt1.split(","))
+    (x0, y0) = parse_geo(pt0)
+    (x1, y1) = parse_geo(pt1)
 
     if (abs(x0 - x1) == abs(y0 - y1)):
         # valid diagonal move
         return True
-    elif ((x0 == x1) and (abs(y0 - y2) == 2)):
+    elif ((x0 == x1) and (abs(y0 - y1) == 2)):
         # valid vertical move
         return True
     else:
         return False
 
 
+class Dice:
+    """
+    compiled form of a dice notation, e.g., "d10+1/20, >0"
+
+    the notation gets parsed once, and since each face of the die maps
+    to a fixed value and acceptance, the arithmetic for every face is
+    precomputed into a lookup table -- so a roll costs one draw from
+    the RNG plus an index
+    """
+
+    ROLL_PAT = re.compile("^d(\\d+)(.*)$")
+    OP_PAT = re.compile("[\\-\\+\\*\\/]\\d+")
+    COND_PAT = re.compile("^\\s*(<=|>=|==|!=|<|>)\\s*(-?\\d+(?:\\.\\d*)?)\\s*$")
+
+    OPS = {
+        "+": operator.add,
+        "-": operator.sub,
+        "*": operator.mul,
+        "/": operator.truediv,
+        }
+
+    COMPARE = {
+        "<": operator.lt,
+        "<=": operator.le,
+        ">": operator.gt,
+        ">=": operator.ge,
+        "==": operator.eq,
+        "!=": operator.ne,
+        }
+
+
+    def __init__ (self, notation):
+        """
+        parse the notation and build the table of (value, accepted) per face
+        """
+
+        self.notation = notation
+
+        try:
+            roll, cond = notation.split(", ")
+        except ValueError:
+            raise ValueError("bad dice notation: %s" % repr(notation))
+
+        m = self.ROLL_PAT.match(roll)
+        c = self.COND_PAT.match(cond)
+
+        if not m or not c:
+            raise ValueError("bad dice notation: %s" % repr(notation))
+
+        self.die_count = int(m.group(1))
+        self.ops = [(self.OPS[op[0]], int(op[1:])) for op in self.OP_PAT.findall(m.group(2))]
+        self.compare = self.COMPARE[c.group(1)]
+        self.threshold = float(c.group(2))
+
+        self.values = []
+        self.accepted = []
+
+        for face in range(0, self.die_count + 1):
+            # NB: each step gets rounded through "%f", to stay
+            # consistent with the original eval() based formulas
+            base = face
+
+            for op, operand in self.ops:
+                base = op(float("%f" % base), operand)
+
+            self.values.append(base)
+            self.accepted.append(self.compare(float("%f" % base), self.threshold))
+
+        self.table = zip(self.values, self.accepted)
+
+
+    def roll (self, rng=random):
+        """
+        roll the dice, returning a (value, accepted) pair
+        """
+
+        return self.table[rng.randint(0, self.die_count)]
+
+
+_dice_cache = {}
+
+def compile_dice (notation):
+    """
+    compile a dice notation, reusing a previous compilation if available
+    """
+
+    dice = _dice_cache.get(notation)
+
+    if dice is None:
+        dice = Dice(notation)
+        _dice_cache[notation] = dice
+
+    return dice
+
+
 def roll_dice (notation):
     """
     simulate a dice roll, based on the given notation
     """
 
-    base = None
-    roll, cond = notation.split(", ")
+    return compile_dice(notation).roll()
+
+
+## registry of the kinds of cards and conditions which a scenario
+## config can reference; third-party kinds register through the
+## "pygame.cards" and "pygame.conditions" entry points
+
+CARD_KINDS = {}
+CONDITION_KINDS = {}
+
+_card_cache = {}
+_plugins_loaded = False
+
+def register_card (cls, kind=None):
+    """
+    register a Card class, by default under its class name
+    """
+
+    CARD_KINDS[kind or cls.__name__] = cls
+    return cls
+
+
+def register_condition (cls, kind=None):
+    """
+    register a Condition class, by default under its class name
+    """
+
+    CONDITION_KINDS[kind or cls.__name__] = cls
+    return cls
+
+
+def load_plugins ():
+    """
+    register the card and condition kinds from installed plugins, once
+    """
+
+    global _plugins_loaded
+
+    if not _plugins_loaded:
+        _plugins_loaded = True
+
+        try:
+            import pkg_resources
+        except ImportError:
+            return
+
+        for group, registry in [("pygame.cards", CARD_KINDS), ("pygame.conditions", CONDITION_KINDS)]:
+            for entry_point in pkg_resources.iter_entry_points(group):
+                registry[entry_point.name] = entry_point.load()
+
+
+def make_condition (cond_conf):
+    """
+    construct a condition from its config
+    """
+
+    return CONDITION_KINDS[cond_conf["kind"]](cond_conf["dice"])
+
+
+def make_card (card_conf):
+    """
+    construct a card from its config, sharing the instance with every
+    other deck which uses the same card -- cards are immutable
+    """
+
+    retry = card_conf["retry"] in [True, "True"]
+    key = (card_conf["kind"], card_conf["event"], card_conf["dice"], retry)
+    card = _card_cache.get(key)
+
+    if card is None:
+        card = CARD_KINDS[card_conf["kind"]](card_conf["event"], card_conf["dice"], retry)
+        _card_cache[key] = card
+
+    return card
+
+
+######################################################################
+## event log
+
+Event = collections.namedtuple("Event", ["game", "turn", "side", "population", "delta", "event"])
+
+# population and event names get interned as integer ids, shared by
+# every event log in the process
+
+EVENT_NAMES = []
+_event_ids = {}
+
+def intern_name (name):
+    """
+    map a population or event name to its integer id
+    """
+
+    name_id = _event_ids.get(name)
+
+    if name_id is None:
+        name_id = len(EVENT_NAMES)
+        EVENT_NAMES.append(name)
+        _event_ids[name] = name_id
+
+    return name_id
+
+
+class MemorySink:
+    """
+    sink which collects event records in memory
+    """
+
+    def __init__ (self):
+        self.events = []
+
+
+    def write (self, game, turn, side, population, delta, event):
+        self.events.append(Event(game, turn, side, EVENT_NAMES[population], delta, EVENT_NAMES[event]))
+
+
+    def close (self):
+        pass
+
+
+class JsonlSink:
+    """
+    sink which streams event records to a file as JSON lines, in batches
+    """
+
+    def __init__ (self, path, batch_size=4096):
+        self.file = open(path, "w")
+        self.batch_size = batch_size
+        self.lines = []
+
+
+    def write (self, game, turn, side, population, delta, event):
+        self.lines.append(json.dumps(Event(game, turn, side, EVENT_NAMES[population], delta, EVENT_NAMES[event])._asdict()))
+
+        if len(self.lines) >= self.batch_size:
+            self.flush()
+
+
+    def flush (self):
+        if self.lines:
+            self.file.write("\n".join(self.lines) + "\n")
+            self.lines = []
+
+
+    def close (self):
+        self.flush()
+        self.file.close()
+
+
+class ColumnarSink:
+    """
+    sink which streams event records to one binary file per column,
+    i.e., PREFIX.game.bin, PREFIX.turn.bin, etc., in batches -- plus
+    PREFIX.names.json with the typecode of each column and the table
+    for the population and event ids
+    """
+
+    COLUMNS = [("game", "l"), ("turn", "i"), ("side", "b"), ("population", "i"), ("delta", "l"), ("event", "i")]
+
+
+    def __init__ (self, prefix, batch_size=65536):
+        self.prefix = prefix
+        self.batch_size = batch_size
+        self.files = [open("%s.%s.bin" % (prefix, name), "wb") for name, code in self.COLUMNS]
+        self.reset()
+
+
+    def reset (self):
+        self.columns = [array.array(code) for name, code in self.COLUMNS]
+
+
+    def write (self, *record):
+        for column, value in zip(self.columns, record):
+            column.append(value)
+
+        if len(self.columns[0]) >= self.batch_size:
+            self.flush()
+
+
+    def flush (self):
+        for f, column in zip(self.files, self.columns):
+            column.tofile(f)
+
+        self.reset()
+
+
+    def close (self):
+        self.flush()
+
+        for f in self.files:
+            f.close()
+
+        with open("%s.names.json" % self.prefix, "w") as f:
+            json.dump({ "columns": self.COLUMNS, "names": EVENT_NAMES }, f)
+
+
+def open_sink (spec):
+    """
+    open an event sink from a spec such as "jsonl:events.jsonl" or "columnar:events"
+    """
+
+    kind, _, path = spec.partition(":")
+
+    if kind == "jsonl":
+        return JsonlSink(path)
+    elif kind == "columnar":
+        return ColumnarSink(path)
+    elif kind == "memory":
+        return MemorySink()
+    else:
+        raise ValueError("unknown event sink: %s" % repr(spec))
+
+
+class EventLog:
+    """
+    compact, array-backed log of the events in one game
+
+    retention is one of "off", "ring" (the last N events) or "full";
+    independently of that, every event gets streamed to the sink, if any
+    """
+
+    RETENTION = ["off", "ring", "full"]
+
+
+    def __init__ (self, game_id, retention="full", capacity=0, sink=None, stats=None):
+        if retention not in self.RETENTION:
+            raise ValueError("unknown event retention: %s" % repr(retention))
+
+        if (retention == "ring") and (capacity < 1):
+            raise ValueError("ring retention needs a capacity of at least 1")
+
+        self.game_id = game_id
+        self.retention = retention
+        self.sink = sink
+        self.stats = stats
+        self.turn = 0
+        self.count = 0
+
+        if retention == "ring":
+            self.capacity = capacity
+            self.turns = array.array("i", [0]) * capacity
+            self.sides = array.array("b", [0]) * capacity
+            self.populations = array.array("i", [0]) * capacity
+            self.deltas = array.array("l", [0]) * capacity
+            self.events = array.array("i", [0]) * capacity
+        else:
+            self.capacity = None
+            self.turns = array.array("i")
+            self.sides = array.array("b")
+            self.populations = array.array("i")
+            self.deltas = array.array("l")
+            self.events = array.array("i")
+
+
+    def record (self, side, population, delta, event):
+        """
+        record an event in the current turn
+        """
+
+        if self.stats is not None:
+            self.stats.add_effect(side, event, delta)
+
+        population = intern_name(population)
+        event = intern_name(event)
+
+        if self.sink:
+            self.sink.write(self.game_id, self.turn, side, population, delta, event)
+
+        if self.retention == "full":
+            self.turns.append(self.turn)
+            self.sides.append(side)
+            self.populations.append(population)
+            self.deltas.append(delta)
+            self.events.append(event)
+        elif self.retention == "ring":
+            i = self.count % self.capacity
+            self.turns[i] = self.turn
+            self.sides[i] = side
+            self.populations[i] = population
+            self.deltas[i] = delta
+            self.events[i] = event
 
-    p = re.compile("^d(\d+)(.*)$")
-    m = p.match(roll)
+        self.count += 1
 
-    if m:
-        die_count = int(m.group(1))
-        base = random.randint(0, die_count)
 
-        for op in re.findall("[\-\+\*\/]\d+", m.group(2)):
-            base = eval("%f %s %s" % (base, op[0], op[1:]))
+    def records (self):
+        """
+        iterate through the retained events, oldest first
+        """
 
-    accepted = eval("%f %s" % (base, cond))
+        if self.retention == "full":
+            index = range(0, self.count)
+        elif self.retention == "ring":
+            n = min(self.count, self.capacity)
+            index = [(self.count - n + i) % self.capacity for i in range(0, n)]
+        else:
+            index = []
 
-    return base, accepted
+        for i in index:
+            yield Event(self.game_id, self.turns[i], self.sides[i], EVENT_NAMES[self.populations[i]], self.deltas[i], EVENT_NAMES[self.events[i]])
 
 
 ######################################################################
@@ -79,14 +562,18 @@ class Condition:
     """
 
     def __init__ (self, notation=None):
-        self.notation = notation
+        self.dice = None
+
+        if notation:
+            self.dice = compile_dice(notation)
 
 
     def execute (self, game, us, them):
-        if debug:
-            print "nop"
+        if trace.conditions:
+            trace.emit("conditions", "nop")
 
 
+@register_condition
 class PreventDraw (Condition):
     def __init__(self, notation):
         Condition.__init__(self, notation)
@@ -98,30 +585,24 @@ class PreventDraw (Condition):
         otherwise the Status Quo prevails
         """
 
-        meta_0 = json.dumps(us.meta)
-        meta_1 = json.dumps(them.meta)
-
-        unmeta_0 = json.loads(meta_0)
-        len_log_0 = len(filter(lambda x: len(x) < 1, unmeta_0["log"]))
-        del unmeta_0["log"]
-
-        unmeta_1 = json.loads(meta_1)
-        len_log_1 = len(filter(lambda x: len(x) < 1, unmeta_1["log"]))
-        del unmeta_1["log"]
-
-        full_meta = str(unmeta_0) + str(unmeta_1)
+        len_stalemate = game.outcome["len_stalemate"]
+        full_meta = (us.state.fingerprint(), them.state.fingerprint())
 
-        if len(filter(lambda x: full_meta != x, game.last_full_meta)) == 0:
+        if all([full_meta == x for x in game.last_full_meta]):
             game.game_over(them, "stalemate")
-        elif (len_log_0 > game.outcome["len_stalemate"]) or (len_log_1 > game.outcome["len_stalemate"]):
+        elif (us.n_quiet > len_stalemate) or (them.n_quiet > len_stalemate):
             game.game_over(them, "stalemate")
         else:
             game.last_full_meta.append(full_meta)
-        
-            if len(game.last_full_meta) > game.outcome["len_stalemate"]:
-                game.last_full_meta = game.last_full_meta[0:game.outcome["len_stalemate"]]
 
+            # NB: the window keeps its *first* N entries, which is the
+            # established behavior for len_stalemate -- it stays
+            # bounded by N, so this is O(1) per turn
+            if len(game.last_full_meta) > len_stalemate:
+                del game.last_full_meta[len_stalemate:]
 
+
+@register_condition
 class SimulateJail (Condition):
     def __init__(self, notation):
         Condition.__init__(self, notation)
@@ -132,21 +613,22 @@ class SimulateJail (Condition):
         model for the minimum number of Fellowship jail staff needed
         """
 
+        state = us.state
         n_reserve = us.calc_reserve()
 
-        if n_reserve > us.meta["n_forces"]:
-            roll, accepted = roll_dice(self.notation)
+        if n_reserve > state.n_forces:
+            roll, accepted = self.dice.roll(us.roll_rng)
 
             if accepted:
-                delta = round(roll * us.meta["n_captive"], 0)
-                us.log_event(delta, "captive_state", "JAIL AMNESTY!")
+                delta = round(roll * state.n_captive, 0)
+                us.log_event(delta, "captive_state", "JAIL AMNESTY!", "conditions")
                 us.add_captive(game, -delta)
                 them.add_forces(game, delta)
 
-        us.meta["n_reserve"] = min(n_reserve, us.meta["n_forces"])
-        us.meta["n_deployed"] = us.meta["n_forces"] - us.meta["n_reserve"]
+        state.set_reserve(n_reserve)
 
 
+@register_condition
 class SimulateHospital (Condition):
     def __init__(self, notation):
         Condition.__init__(self, notation)
@@ -157,18 +639,18 @@ class SimulateHospital (Condition):
         model for the minimum number of Founders hospital staff needed
         """
 
+        state = us.state
         n_reserve = us.calc_reserve()
-        them.meta["rage"] = 0.0
+        them.state.rage = 0.0
 
-        if n_reserve > us.meta["n_forces"]:
-            roll, accepted = roll_dice(self.notation)
+        if n_reserve > state.n_forces:
+            roll, accepted = self.dice.roll(us.roll_rng)
 
             if accepted:
-                us.log_event(0, "captive_state", "RIOT COP RAGE!")
-                them.meta["rage"] += 0.2
+                us.log_event(0, "captive_state", "RIOT COP RAGE!", "conditions")
+                them.state.rage += 0.2
 
-        us.meta["n_reserve"] = min(n_reserve, us.meta["n_forces"])
-        us.meta["n_deployed"] = us.meta["n_forces"] - us.meta["n_reserve"]
+        state.set_reserve(n_reserve)
 
 
 class Card (Condition):
@@ -182,6 +664,7 @@ class Card (Condition):
         self.retry = retry
 
 
+@register_card
 class ForceReductionCard (Card):
     """
     representation for a 'force reduction' card in the deck
@@ -192,27 +675,28 @@ class ForceReductionCard (Card):
 
 
     def execute (self, game, us, them):
-        roll, accepted = roll_dice(self.notation)
+        roll, accepted = self.dice.roll(us.roll_rng)
 
         if accepted:
-            delta = round(roll * us.meta["n_deployed"], 0)
+            delta = round(roll * us.state.n_deployed, 0)
 
-            if us.meta["rage"] > 0.5:
+            if us.state.rage > 0.5:
                 REDUCE_FACTOR = 5.0
                 casualty = round(roll / REDUCE_FACTOR * delta, 0)
 
-                if debug:
-                    print them.meta["side"], ":", "CASUALTY", casualty
+                if trace.cards:
+                    trace.emit("cards", them.meta["side"], ":", "CASUALTY", casualty)
 
                 delta -= casualty
                 them.log_event(casualty, "forces_name", "casualties")
-                them.meta["n_casualty"] += casualty
+                them.state.n_casualty += casualty
 
             them.log_event(delta, "forces_name", self.event)
             us.add_captive(game, delta)
             them.add_forces(game, -delta)
 
 
+@register_card
 class InsurrectionCard (Card):
     """
     representation for an 'insurrection' card in the deck
@@ -223,22 +707,23 @@ class InsurrectionCard (Card):
 
 
     def execute (self, game, us, them):
-        roll, accepted = roll_dice(self.notation)
+        roll, accepted = self.dice.roll(us.roll_rng)
 
         if accepted:
-            delta = round(roll * them.meta["n_captive"], 0)
+            delta = round(roll * them.state.n_captive, 0)
 
-            if debug:
-                print "exec insurrect", them.meta["n_captive"], "delta", delta
+            if trace.cards:
+                trace.emit("cards", "exec insurrect", them.state.n_captive, "delta", delta)
 
             INSURRECT_FACTOR = 10.0
 
-            if delta > (them.meta["init_force"] / INSURRECT_FACTOR):
+            if delta > (them.state.init_force / INSURRECT_FACTOR):
                 them.log_event(delta, "forces_name", self.event)
                 them.add_captive(game, -delta)
                 us.add_forces(game, delta)
 
 
+@register_card
 class ConversionCard (Card):
     """
     representation for a 'conversion' card in the deck
@@ -249,16 +734,17 @@ class ConversionCard (Card):
 
 
     def execute (self, game, us, them):
-        roll, accepted = roll_dice(self.notation)
+        roll, accepted = self.dice.roll(us.roll_rng)
 
         if accepted:
-            delta = round(roll * them.meta["n_forces"], 0)
+            delta = round(roll * them.state.n_forces, 0)
 
             them.log_event(delta, "forces_name", self.event)
             them.add_forces(game, -delta)
             us.add_forces(game, delta)
 
 
+@register_card
 class SeriouslyWeirdCard (Card):
     """
     representation for a 'seriously weird' card in the deck
@@ -269,14 +755,15 @@ class SeriouslyWeirdCard (Card):
 
 
     def execute (self, game, us, them):
-        roll, accepted = roll_dice(self.notation)
+        roll, accepted = self.dice.roll(us.roll_rng)
 
         if accepted:
-            delta = round(roll * them.meta["n_forces"], 0)
+            delta = round(roll * them.state.n_forces, 0)
             them.log_event(delta, "forces_name", self.event)
             them.add_forces(game, -delta)
 
 
+@register_card
 class WinningPlayCard (Card):
     """
     representation for a 'winning play' card in the deck
@@ -286,187 +773,578 @@ class WinningPlayCard (Card):
         Card.__init__(self, event, notation, retry)
 
     def execute (self, game, us, them):
-        roll, accepted = roll_dice(self.notation)
+        roll, accepted = self.dice.roll(us.roll_rng)
 
         if accepted:
-            print "WINNING PLAY"
+            if trace.cards:
+                trace.emit("cards", "WINNING PLAY")
 
 
-class Player:
+@register_card
+class MovementCard (Card):
     """
-    representation for a player in the game
+    representation for a 'movement' card in the deck, which moves part
+    of the player's largest force on the map to a neighboring hex
     """
 
-    def __init__ (self, meta, game):
-        """
-        initialize
-        """
+    def __init__ (self, event, notation, retry=False):
+        Card.__init__(self, event, notation, retry)
 
-        self.meta = meta
-        self.opponent = None
-        self.meta["log"] = []
 
-        self.meta["init_force"] = self.count_force(game)
-        self.meta["n_forces"] = self.meta["init_force"]
-        self.meta["n_deployed"] = self.meta["init_force"]
+    def execute (self, game, us, them):
+        roll, accepted = self.dice.roll(us.roll_rng)
 
-        self.meta["n_captive"] = 0
-        self.meta["n_reserve"] = 0
-        self.meta["n_casualty"] = 0
+        if accepted:
+            index = us.meta["index"]
+            src = game.forces.largest(index)
 
-        # populate conditions in the simulation
+            if (src is not None) and game.forces.map.moves[src]:
+                dst = us.roll_rng.choice(game.forces.map.moves[src])
+                n_src = game.forces.forces[index][src]
+                # a roll over 1 can't move more than the hex holds
+                delta = min(round(roll * n_src, 0), n_src)
 
-        self.conditions = []
+                if delta > 0:
+                    us.log_event(delta, "forces_name", self.event)
+                    game.forces.move(index, src, dst, int(delta))
 
-        for cond_conf in self.meta["conditions"]:
-            cond_raw = "".join([cond_conf["kind"], '("', cond_conf["dice"], '")'])
-            cond = eval(cond_raw)
-            self.conditions.append(cond)
 
-        del self.meta["conditions"]
+class Deck:
+    """
+    representation for the cards left in a player's deck
 
-        # populate cards in the deck
+    cards are drawn uniformly at random, the same as random.choice()
+    over the list, and a drawn card gets swapped with the last card in
+    play and the cursor moves down -- so draw and remove are O(1);
+    retry cards simply stay in play
+    """
 
-        self.deck = []
+    def __init__ (self, cards):
+        self.cards = list(cards)
+        self.size = len(self.cards)
 
-        for card_conf in self.meta["cards"]:
-            card_raw = "".join([card_conf["kind"], '("', card_conf["event"], '", "', card_conf["dice"], '", ', card_conf["retry"], ')'])
-            card = eval(card_raw)
 
-            for i in range(0, card_conf["num"]):
-                self.deck.append(card)
+    def __len__ (self):
+        return self.size
 
-        del self.meta["cards"]
 
+    def draw (self, rng=random):
+        """
+        draw a card, removing it from play unless it's a retry card
+        """
 
-    def set_opponent (self, opponent):
-        self.opponent = opponent
+        i = int(rng.random() * self.size)
+        card = self.cards[i]
 
+        if not card.retry:
+            self.size -= 1
+            self.cards[i] = self.cards[self.size]
+            self.cards[self.size] = card
 
-    def count_force (self, game):
-        """
-        count this player's forces, distributed across the map
-        """
+        return card
 
-        n_forces = 0
 
-        for geo, hex in game.outcome["map"].items():
-            n_forces += hex["force"][self.meta["index"]]
+class PlayerState (object):
+    """
+    the mutable counters for a player during a game, kept apart from
+    the static config in Player.meta, which the scenario shares
+    """
 
-        return n_forces
+    __slots__ = ["init_force", "n_forces", "n_deployed", "n_captive", "n_reserve", "n_casualty", "rage"]
 
 
-    def has_play (self):
+    def __init__ (self, init_force, rage=0.0):
+        self.init_force = init_force
+        self.n_forces = init_force
+        self.n_deployed = init_force
+        self.n_captive = 0
+        self.n_reserve = 0
+        self.n_casualty = 0
+        self.rage = rage
+
+
+    def values (self):
         """
-        test whether this player has a next play available
+        the counters as a tuple, in the order of the slots
         """
 
-        return len(self.deck) > 0
+        return (self.init_force, self.n_forces, self.n_deployed, self.n_captive, self.n_reserve, self.n_casualty, self.rage)
+
+
+    # the numeric state, to compare across turns
+    fingerprint = values
 
 
-    def pick_card (self):
+    def set_reserve (self, n_reserve):
         """
-        pick the next card to play
+        hold back the reserve, up to the whole force, and deploy the rest
         """
 
-        card = random.choice(self.deck)
+        n_forces = self.n_forces
+        self.n_reserve = n_reserve = min(n_reserve, n_forces)
+        self.n_deployed = n_forces - n_reserve
 
-        if not card.retry:
-            self.deck.remove(card)
 
-        return card
+    def to_dict (self):
+        return dict(zip(self.__slots__, self.values()))
 
 
-    def calc_reserve (self):
+class Player:
+    """
+    representation for a player in the game
+    """
+
+    def __init__ (self, conf, game):
         """
-        calculate the required reserves
+        initialize from the compiled config for one side of a Scenario
         """
 
-        MIN_RESERVE = 2.0
-        RESERVE_RATIO = 0.05
-
-        return round(max(MIN_RESERVE, self.meta["n_captive"] * RESERVE_RATIO), 0)
+        self.meta = conf["meta"]
+        self.opponent = None
+        self.events = game.events
+        self.side = int(self.meta["index"])
+        self.state = PlayerState(conf["init_force"], self.meta["rage"])
 
+        # RNGs to draw cards and roll dice: the game's own RNG, unless
+        # the game has separate substreams per player, cf. PairedSimulation
 
-    def add_forces (self, game, delta):
-        if delta != 0.0:
-            if debug:
-                print "add_forces", self.meta["n_forces"], "delta", delta
+        if game.substreams is None:
+            self.draw_rng = self.roll_rng = game.rng
+        else:
+            self.draw_rng = random.Random(game.substreams * 4 + 2 * self.side)
+            self.roll_rng = random.Random(game.substreams * 4 + 2 * self.side + 1)
 
-            if self.meta["n_forces"] + delta <= 0:
-                game.game_over(self.opponent, "overwhelmed opponents")
-            else:
-                self.meta["n_forces"] += delta;
+        # number of turns in which this player had no log events, and
+        # the number of log events so far in the current turn
 
-            if not (self.meta["n_forces"] >= 0):
-                raise AssertionError("negative forces size: " + self.meta["side"] + str(self.meta))
+        self.n_quiet = 0
+        self.n_events = 0
 
+        # conditions and cards are shared by every game in the
+        # scenario; only the deck itself needs a copy per game
 
-    def add_captive (self, game, delta):
-        if delta != 0.0:
-            if debug:
-                print "add_captive", self.meta["n_captive"], "delta", delta
+        self.conditions = conf["conditions"]
+        self.deck = Deck(conf["deck"])
 
-            self.meta["n_captive"] += delta;
 
-            if not (self.meta["n_captive"] >= 0):
-                raise AssertionError("negative captive size: " + self.meta["side"] + str(self.meta))
+    def set_opponent (self, opponent):
+        self.opponent = opponent
 
 
-    def execute (self, game):
+    def count_force (self, game):
+        """
+        count this player's forces, distributed across the map
+        """
+
+        return game.forces.total(self.meta["index"])
+
+
+    def fingerprint (self):
+        """
+        the numeric state of this player, to compare across turns
+        """
+
+        return self.state.fingerprint()
+
+
+    def to_dict (self):
+        """
+        view of the config and state of this player, as in the outcome JSON
+        """
+
+        view = dict(self.meta)
+        view.update(self.state.to_dict())
+
+        return view
+
+
+    def has_play (self):
+        """
+        test whether this player has a next play available
+        """
+
+        return self.deck.size > 0
+
+
+    def pick_card (self, rng=random):
+        """
+        pick the next card to play
+        """
+
+        return self.deck.draw(rng)
+
+
+    def calc_reserve (self):
+        """
+        calculate the required reserves
+        """
+
+        MIN_RESERVE = 2.0
+        RESERVE_RATIO = 0.05
+
+        return round(max(MIN_RESERVE, self.state.n_captive * RESERVE_RATIO), 0)
+
+
+    def add_forces (self, game, delta):
+        if delta != 0.0:
+            state = self.state
+
+            if trace.forces:
+                trace.emit("forces", "add_forces", state.n_forces, "delta", delta)
+
+            if state.n_forces + delta <= 0:
+                game.game_over(self.opponent, "overwhelmed opponents")
+            else:
+                state.n_forces += delta;
+
+            if not (state.n_forces >= 0):
+                raise AssertionError("negative forces size: " + self.meta["side"] + str(self.to_dict()))
+
+
+    def add_captive (self, game, delta):
+        if delta != 0.0:
+            state = self.state
+
+            if trace.forces:
+                trace.emit("forces", "add_captive", state.n_captive, "delta", delta)
+
+            state.n_captive += delta;
+
+            if not (state.n_captive >= 0):
+                raise AssertionError("negative captive size: " + self.meta["side"] + str(self.to_dict()))
+
+
+    def execute (self, game):
         """
         select a play and execute the strategy for it
         """
 
-        card = self.pick_card()
+        card = self.pick_card(self.draw_rng)
         card.execute(game, self, self.opponent)
 
 
-    def log_event (self, delta, population, event):
+    def log_event (self, delta, population, event, category="cards"):
         """
-        record a loss in terms of impact on a given population, due to a specified event
+        record a loss in terms of impact on a given population, due to a
+        specified event, traced under the category of its cause
         """
 
-        log_entry = [int(delta), self.meta[population], event]
-        
-        if debug:
-            print log_entry
+        if getattr(trace, category):
+            trace.emit(category, [int(delta), self.meta[population], event])
+
+        self.events.record(self.side, self.meta[population], int(delta), event)
+
+        if self.n_events == 0:
+            self.n_quiet -= 1
+
+        self.n_events += 1
+
+
+    def start_turn (self):
+        """
+        start a new turn, counted as quiet until an event
+        """
 
-        self.meta["log"][-1].append(log_entry)
+        self.n_quiet += 1
+        self.n_events = 0
 
 
-class GameIterator:
+class HexMap:
     """
-    representation for a game iterator
+    representation for the hex map of a scenario, indexed by coordinates
+
+    hexes are keyed "x,y" in the config; one step to a neighboring hex
+    is either diagonal or two rows vertically, as in verify_move() --
+    the map is immutable during play, so every Game shares it
     """
 
-    game_dict = {}
+    STEPS = [(1, 1), (1, -1), (-1, 1), (-1, -1), (0, 2), (0, -2)]
+    NO_ACCESS = "NO ACCESS"
+
+
+    def __init__ (self, map_conf):
+        """
+        index the hexes of a map config into arrays
+        """
+
+        self.geos = sorted(map_conf.keys(), key=parse_geo)
+        self.coords = map(parse_geo, self.geos)
+        self.index = dict([(geo, i) for i, geo in enumerate(self.geos)])
+        self.sites = [map_conf[geo]["site"] for geo in self.geos]
+        self.has = [map_conf[geo]["has"] for geo in self.geos]
+
+        # lookup from coordinates to hex index, as a dense array
+
+        xs = [x for x, y in self.coords] or [0]
+        ys = [y for x, y in self.coords] or [0]
+
+        self.x0 = min(xs)
+        self.y0 = min(ys)
+        self.width = max(xs) - self.x0 + 1
+        self.height = max(ys) - self.y0 + 1
+        self.cells = array.array("l", [-1]) * (self.width * self.height)
+
+        for i, (x, y) in enumerate(self.coords):
+            self.cells[(y - self.y0) * self.width + (x - self.x0)] = i
+
+        # initial forces of each player per hex, and their totals
+
+        self.players = sorted(set([p for geo in self.geos for p in map_conf[geo]["force"]]))
+        self.forces = {}
+        self.totals = {}
+
+        self.occupied = {}
+
+        for player in self.players:
+            self.forces[player] = array.array("l", [map_conf[geo]["force"].get(player, 0) for geo in self.geos])
+            self.totals[player] = sum(self.forces[player])
+            self.occupied[player] = set([i for i, n in enumerate(self.forces[player]) if n > 0])
+
+        # neighboring hexes, one step away
 
+        self.neighbors = []
 
-    def __init__ (self, game):
+        for i, (x, y) in enumerate(self.coords):
+            steps = [self.hex_at(x + dx, y + dy) for dx, dy in self.STEPS]
+            self.neighbors.append(tuple([j for j in steps if (j is not None) and verify_move(self.geos[i], self.geos[j])]))
+
+        # legal moves, i.e., neighbors excluding any sites with no access
+
+        self.access = [site != self.NO_ACCESS for site in self.sites]
+        self.moves = []
+
+        for i in range(0, len(self.geos)):
+            if self.access[i]:
+                self.moves.append(tuple([j for j in self.neighbors[i] if self.access[j]]))
+            else:
+                self.moves.append(())
+
+
+    def __len__ (self):
+        return len(self.geos)
+
+
+    def total (self, player):
         """
-        initialize a game iterator, based on the UUID
+        initial total of a player's forces across the map
         """
 
-        self.game = game
-        self.uuid = game.outcome["uuid"]
-        self.game_dict[self.uuid] = game
+        return self.totals[player]
 
 
-    def next (self):
+    def hex_at (self, x, y):
         """
-        iterate to run game until its end
+        index of the hex at the given coordinates, or None
         """
 
-        if not self.uuid in self.game_dict:
-            raise StopIteration
+        x -= self.x0
+        y -= self.y0
+
+        if (0 <= x < self.width) and (0 <= y < self.height):
+            i = self.cells[y * self.width + x]
+
+            if i >= 0:
+                return i
+
+        return None
+
+
+    def adjacent (self, i, j):
+        """
+        test whether two hexes are neighbors
+        """
+
+        return j in self.neighbors[i]
+
+
+    def reachable (self, sources, k):
+        """
+        all hexes reachable within K legal moves from any of the source
+        hexes, as a dict of hex index -> number of moves
+        """
+
+        dist = dict([(i, 0) for i in sources if self.access[i]])
+        frontier = dist.keys()
+
+        for step in range(1, k + 1):
+            next_frontier = []
+
+            for i in frontier:
+                for j in self.moves[i]:
+                    if j not in dist:
+                        dist[j] = step
+                        next_frontier.append(j)
+
+            if not next_frontier:
+                break
+
+            frontier = next_frontier
+
+        return dist
+
+
+class MapForces:
+    """
+    representation for the forces on the map during one game
+
+    the per-hex forces start out shared with the HexMap, and get
+    copied on the first change; the total for each player is
+    maintained incrementally, so it costs O(1) regardless of map size
+    """
+
+    def __init__ (self, hexmap):
+        self.map = hexmap
+        self.forces = hexmap.forces
+        self.totals = dict(hexmap.totals)
+        self.occupied = hexmap.occupied
+        self.copied = False
+
+
+    def total (self, player):
+        return self.totals[player]
+
+
+    def add (self, player, i, delta):
+        """
+        add forces for a player on a given hex
+        """
+
+        if not self.copied:
+            self.forces = dict([(p, array.array("l", f)) for p, f in self.forces.items()])
+            self.occupied = dict([(p, set(o)) for p, o in self.occupied.items()])
+            self.copied = True
+
+        n = self.forces[player][i] + delta
+
+        if n < 0:
+            raise ValueError("negative forces on hex %s" % self.map.geos[i])
+        elif n > 0:
+            self.occupied[player].add(i)
         else:
-            outcome = self.game_dict[self.uuid].play_duplex()
+            self.occupied[player].discard(i)
 
-            if outcome["game_over"]:
-                del self.game_dict[self.uuid]
+        self.forces[player][i] = n
+        self.totals[player] += delta
+
+
+    def largest (self, player):
+        """
+        the hex with the largest force for a player, or None
+        """
+
+        forces = self.forces[player]
+        occupied = self.occupied[player]
 
-            return self.game, outcome
+        if occupied:
+            return max(occupied, key=lambda i: (forces[i], -i))
+
+
+    def move (self, player, src, dst, n):
+        """
+        move forces for a player from one hex to another
+        """
+
+        self.add(player, src, -n)
+        self.add(player, dst, n)
+
+
+class Scenario:
+    """
+    representation for a scenario config, loaded and compiled once
+
+    the map, the conditions and the card definitions are immutable
+    during play, so every Game in the scenario shares them
+    """
+
+    PLAYERS = ["player0", "player1"]
+    REQUIRED = ["max_turns", "len_stalemate", "map"] + PLAYERS
+    REQUIRED_PLAYER = ["side", "index", "forces_name", "captive_state", "rage", "conditions", "cards"]
+    REQUIRED_CONDITION = ["kind", "dice"]
+    REQUIRED_CARD = ["kind", "event", "dice", "num", "retry"]
+
+
+    def __init__ (self, conf):
+        """
+        validate and compile a scenario config, parsed from JSON
+        """
+
+        self.validate(conf)
+        self.conf = conf
+
+        self.outcome = dict([(key, value) for key, value in conf.items() if key not in self.PLAYERS])
+        self.map = HexMap(conf["map"])
+        self.players = {}
+
+        for player in self.PLAYERS:
+            self.players[player] = self.compile_player(conf[player])
+
+
+    def validate (self, conf):
+        """
+        test the config for the fields which the game needs
+        """
+
+        def require (item, fields, where):
+            for field in fields:
+                if field not in item:
+                    raise ValueError("scenario: missing '%s' in %s" % (field, where))
+
+        def require_kind (item, registry, where):
+            if item["kind"] not in registry:
+                raise ValueError("scenario: unknown kind '%s' in %s" % (item["kind"], where))
+
+        load_plugins()
+        require(conf, self.REQUIRED, "scenario")
+
+        for player in self.PLAYERS:
+            require(conf[player], self.REQUIRED_PLAYER, player)
+
+            for cond_conf in conf[player]["conditions"]:
+                require(cond_conf, self.REQUIRED_CONDITION, player + " conditions")
+                require_kind(cond_conf, CONDITION_KINDS, player + " conditions")
+
+            for card_conf in conf[player]["cards"]:
+                require(card_conf, self.REQUIRED_CARD, player + " cards")
+                require_kind(card_conf, CARD_KINDS, player + " cards")
+
+
+    def compile_player (self, player_conf):
+        """
+        compile the config for one side of the game
+        """
+
+        meta = dict([(key, value) for key, value in player_conf.items() if key not in ["conditions", "cards"]])
+        init_force = self.map.total(meta["index"])
+
+        # populate conditions in the simulation
+
+        conditions = map(make_condition, player_conf["conditions"])
+
+        # populate cards in the deck
+
+        deck = []
+
+        for card_conf in player_conf["cards"]:
+            deck.extend([make_card(card_conf)] * card_conf["num"])
+
+        return { "meta": meta, "init_force": init_force, "conditions": conditions, "deck": deck }
+
+
+def load_scenario (file_conf):
+    """
+    load and compile a scenario config from a JSON file
+    """
+
+    with open(file_conf, "r") as f:
+        return Scenario(json.load(f))
+
+
+# per-turn outcome of a game: only the counters which changed during
+# the turn, as a tuple of (side, field, value) triples, and the end of
+# the game, if reached
+
+TurnDelta = collections.namedtuple("TurnDelta", ["game", "n_turn", "changes", "end"])
+GameEnd = collections.namedtuple("GameEnd", ["condition", "winner", "margin"])
 
 
 class Game:
@@ -474,44 +1352,119 @@ class Game:
     representation for the game state
     """
 
-    def __init__ (self, file_conf, sim=None):
+    game_ids = itertools.count()
+
+
+    def __init__ (self, scenario, sim=None, rng=None, events=None, substreams=None):
         """
-        initialize a game with two players and run until end
+        initialize a game with two players and run until end, from a
+        Scenario or the path of a scenario config; given a SUBSTREAMS
+        seed, each player draws cards and rolls dice from its own RNGs
         """
 
-        with open(file_conf, "r") as f:
-            self.outcome = json.load(f)
+        if rng is None:
+            rng = random
+
+        if isinstance(scenario, basestring):
+            scenario = load_scenario(scenario)
 
+        self.rng = rng
+        self.substreams = substreams
+        self.scenario = scenario
+
+        if events is None:
+            events = EventLog(next(self.game_ids))
+
+        self.events = events
+        self.game_id = events.game_id
+
+        self.outcome = dict(scenario.outcome)
         self.outcome["n_turn"] = 1
         self.outcome["game_over"] = False
-        self.outcome["uuid"] = str(uuid.uuid1())
+        self.outcome["game_id"] = self.game_id
+
+        self.forces = MapForces(scenario.map)
 
-        self.founder = Player(self.outcome["player0"], self)
-        self.fellows = Player(self.outcome["player1"], self)
+        self.founder = Player(scenario.players["player0"], self)
+        self.fellows = Player(scenario.players["player1"], self)
 
         self.founder.set_opponent(self.fellows)
         self.fellows.set_opponent(self.founder)
 
-        del self.outcome["player0"]
-        del self.outcome["player1"]
-
         self.sim = sim
-        self.last_full_meta = ["0", "0"]
+        self.last_full_meta = [None, None]
+        self.last_values = [self.founder.state.values(), self.fellows.state.values()]
+
+
+    def __iter__ (self):
+        return self.stream()
+
+
+    def stream (self, final_only=False):
+        """
+        generator which runs the game until its end, yielding the game
+        and its outcome after each turn -- or, with FINAL_ONLY, just
+        once for the final outcome
+        """
+
+        while not self.outcome["game_over"]:
+            self.advance()
 
+            if not final_only:
+                yield self, self.update_outcome()
 
-    def __iter__(self):
-        return GameIterator(self)
+        if final_only:
+            yield self, self.update_outcome()
+
+
+    def deltas (self):
+        """
+        generator which runs the game until its end, yielding the
+        TurnDelta for each turn
+        """
+
+        while not self.outcome["game_over"]:
+            yield self.play_duplex()
 
 
     def play_duplex (self):
         """
-        iterate to run game until end
+        run one turn of the game, returning what changed as a TurnDelta
+        """
+
+        if self.outcome["game_over"]:
+            raise StopIteration
+
+        self.advance()
+
+        changes = []
+
+        for player in [self.founder, self.fellows]:
+            last = self.last_values[player.side]
+            values = player.state.values()
+
+            if values != last:
+                for i in xrange(0, len(values)):
+                    if values[i] != last[i]:
+                        changes.append((player.side, PlayerState.__slots__[i], values[i]))
+
+                self.last_values[player.side] = values
+
+        end = self.outcome.get("end")
+
+        if end is not None:
+            end = GameEnd(end["condition"], end["winner"], end["margin"])
+
+        return TurnDelta(self.game_id, self.outcome["n_turn"], tuple(changes), end)
+
+
+    def advance (self):
+        """
+        advance the game by one turn, or else conclude it
         """
 
         try:
-            if self.outcome["game_over"]:
-                raise StopIteration
-            elif (self.outcome["n_turn"] <= self.outcome["max_turns"]):
+            if (self.outcome["n_turn"] <= self.outcome["max_turns"]):
                 self.attempt_turn()
             else:
                 self.conclude()
@@ -520,22 +1473,40 @@ class Game:
             self.outcome["end"] = ex.value
             self.outcome["game_over"] = True
 
-        self.outcome[self.founder.meta["index"]] = self.founder.meta
-        self.outcome[self.fellows.meta["index"]] = self.fellows.meta
+
+    def update_outcome (self):
+        """
+        fill in the players' current state in the outcome
+        """
+
+        self.outcome[self.founder.meta["index"]] = self.founder.to_dict()
+        self.outcome[self.fellows.meta["index"]] = self.fellows.to_dict()
 
         return self.outcome
 
 
+    def materialize (self):
+        """
+        the full state of the game as a new outcome dict, which the
+        caller may keep
+        """
+
+        outcome = dict(self.update_outcome())
+
+        if "end" in outcome:
+            outcome["end"] = dict(outcome["end"])
+
+        return outcome
+
+
     def attempt_turn (self):
         """
         advance the game play for one turn
         """
 
-        self.founder.count_force(self)
-        self.fellows.count_force(self)
-
-        self.founder.meta["log"].append([])
-        self.fellows.meta["log"].append([])
+        self.events.turn = self.outcome["n_turn"]
+        self.founder.start_turn()
+        self.fellows.start_turn()
 
         ## advance to next turn
 
@@ -563,9 +1534,9 @@ class Game:
 
         if self.outcome["n_turn"] >= self.outcome["max_turns"]:
             self.game_over(self.fellows, "status quo")
-        elif self.founder.meta["n_forces"] > self.fellows.meta["n_forces"]:
+        elif self.founder.state.n_forces > self.fellows.state.n_forces:
             self.game_over(self.founder, "both ran out of cards")
-        elif self.fellows.meta["n_forces"] > self.founder.meta["n_forces"]:
+        elif self.fellows.state.n_forces > self.founder.state.n_forces:
             self.game_over(self.fellows, "both ran out of cards")
         else:
             self.game_over(self.fellows, "status quo")
@@ -576,77 +1547,1154 @@ class Game:
         winning condition terminates game
         """
 
-        self.sim.tally(self.founder)
-
         loser = winner.opponent
-        margin = winner.meta["n_forces"] - loser.meta["n_forces"]
+        margin = winner.state.n_forces - loser.state.n_forces
         stats = { "condition": condition, "winner": winner.meta["side"], "margin": int(margin) }
 
         raise GameOverException(stats)
 
 
-    def report (self, outcome):
+    def report_lines (self, outcome):
         """
-        print a text report of the game outcome
+        generate the lines of a text report of the game outcome
         """
 
-        print "n_turn", outcome["n_turn"]
-        print json.dumps(outcome["0"])
-        print json.dumps(outcome["1"])
+        yield "n_turn %d" % outcome["n_turn"]
+        yield json.dumps(outcome["0"])
+        yield json.dumps(outcome["1"])
 
         if "end" in outcome:
-            print json.dumps(outcome['end'])
+            yield json.dumps(outcome['end'])
 
-        #print outcome.keys()
-        #print json.dumps(outcome)
+        for event in self.events.records():
+            yield json.dumps(event._asdict())
 
 
-class Simulation:
+    def report (self, outcome):
+        """
+        print a text report of the game outcome
+        """
+
+        for line in self.report_lines(outcome):
+            print line
+
+
+def materialize (scenario, deltas):
     """
-    representation for the game simulation
+    replay a sequence of TurnDelta for one game onto the initial state
+    of a Scenario, returning the full outcome dict as of the last turn
     """
 
-    def __init__ (self, file_conf, max_iterations):
-        self.file_conf = file_conf
-        self.max_iterations = max_iterations
-        self.win_tally = { "0": 0, "1": 0 }
+    outcome = dict(scenario.outcome)
+    outcome["n_turn"] = 1
+    outcome["game_over"] = False
 
+    views = []
 
-    def simulate (self):
-        """
-        iterate through N games to collect statistics
-        """
-        
-        for i in range(0, self.max_iterations):
-            for game, outcome in Game(file_conf, sim):
-                if debug:
-                    game.report(outcome)
+    for player in ["player0", "player1"]:
+        conf = scenario.players[player]
+        view = dict(conf["meta"])
+        view.update(PlayerState(conf["init_force"], conf["meta"]["rage"]).to_dict())
+        outcome[view["index"]] = view
+        views.append(view)
 
+    for delta in deltas:
+        outcome["game_id"] = delta.game
+        outcome["n_turn"] = delta.n_turn
 
-    def tally (self, winner):
-        """
-        tally counts for winning players
-        """
+        for side, field, value in delta.changes:
+            views[side][field] = value
 
-        self.win_tally[winner.meta["index"]] += 1
+        if delta.end is not None:
+            outcome["end"] = delta.end._asdict()
+            outcome["game_over"] = True
 
+    return outcome
 
-    def report (self):
-        """
-        report summary statistics for the simulation
-        """
 
-        print self.win_tally["0"] / float(self.max_iterations)
+class RunningStats:
+    """
+    mean and variance of a stream of values, by Welford's algorithm
+    """
+
+    def __init__ (self):
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
 
 
-######################################################################
-## command line interface
+    def add (self, x):
+        self.n += 1
+        delta = x - self.mean
+        self.mean += delta / float(self.n)
+        self.m2 += delta * (x - self.mean)
+
+
+    def merge (self, other):
+        n = self.n + other.n
+
+        if n > 0:
+            delta = other.mean - self.mean
+            self.m2 += other.m2 + delta * delta * self.n * other.n / float(n)
+            self.mean += delta * other.n / float(n)
+
+        self.n = n
 
-if __name__ == "__main__":
-    file_conf = sys.argv[1]
-    max_iterations = int(sys.argv[2])
 
-    sim = Simulation(file_conf, max_iterations)
+    def variance (self):
+        if self.n < 2:
+            return 0.0
+
+        return self.m2 / (self.n - 1)
+
+
+    def half_width (self, z=1.96):
+        """
+        half-width of the normal confidence interval on the mean
+        """
+
+        if self.n < 2:
+            return float("inf")
+
+        return z * math.sqrt(self.variance() / self.n)
+
+
+class Statistics:
+    """
+    summary statistics for the outcomes of a simulation, accumulated
+    online in constant memory: the winner and end condition counts, a
+    histogram of game lengths with one bin per turn, the mean and
+    variance of the winning margin (as RunningStats), and the count and
+    total delta of the events for each card, per side
+
+    partial results from parallel shards combine through merge()
+    """
+
+    STATISTICS = ["win_rate", "margin"]
+
+
+    def __init__ (self, scenario):
+        self.sides = dict([(conf["meta"]["side"], conf["meta"]["index"]) for conf in scenario.players.values()])
+        self.games = 0
+        self.wins = dict([(index, 0) for index in self.sides.values()])
+        self.ends = {}
+        self.turns = array.array("l", [0]) * (scenario.outcome["max_turns"] + 2)
+        self.margin = RunningStats()
+        self.effects = {}
+
+
+    def add (self, outcome):
+        """
+        add the final outcome of a game
+        """
+
+        end = outcome["end"]
+
+        self.games += 1
+        self.wins[self.sides[end["winner"]]] += 1
+        self.ends[end["condition"]] = self.ends.get(end["condition"], 0) + 1
+        self.turns[min(outcome["n_turn"], len(self.turns) - 1)] += 1
+        self.margin.add(end["margin"])
+
+
+    def add_effect (self, side, event, delta):
+        """
+        add the effect of one event, cf. Player.log_event()
+        """
+
+        key = (side, event)
+        effect = self.effects.get(key)
+
+        if effect is None:
+            self.effects[key] = [1, delta]
+        else:
+            effect[0] += 1
+            effect[1] += delta
+
+
+    def merge (self, other):
+        """
+        merge the statistics from another (partial) simulation
+        """
+
+        self.games += other.games
+        self.margin.merge(other.margin)
+
+        for index, count in other.wins.items():
+            self.wins[index] += count
+
+        for condition, count in other.ends.items():
+            self.ends[condition] = self.ends.get(condition, 0) + count
+
+        for i in xrange(0, len(other.turns)):
+            self.turns[i] += other.turns[i]
+
+        for key, (count, total) in other.effects.items():
+            effect = self.effects.setdefault(key, [0, 0])
+            effect[0] += count
+            effect[1] += total
+
+
+    def margin_variance (self):
+        """
+        sample variance of the winning margin
+        """
+
+        return self.margin.variance()
+
+
+    def mean_turns (self):
+        """
+        mean length of a game, in turns
+        """
+
+        if self.games == 0:
+            return 0.0
+
+        return sum([n_turn * count for n_turn, count in enumerate(self.turns)]) / float(self.games)
+
+
+    def win_rate (self, index="0", z=1.96):
+        """
+        win rate for a player, with its Wilson score interval at the
+        given z, as (rate, low, high)
+        """
+
+        n = self.games
+
+        if n == 0:
+            return 0.0, 0.0, 1.0
+
+        p = self.wins[index] / float(n)
+        center = (p + z * z / (2.0 * n)) / (1.0 + z * z / n)
+        half = z * math.sqrt(p * (1.0 - p) / n + z * z / (4.0 * n * n)) / (1.0 + z * z / n)
+
+        return p, max(0.0, center - half), min(1.0, center + half)
+
+
+    def half_width (self, statistic="win_rate", z=1.96):
+        """
+        half-width of the confidence interval on a statistic: the
+        founders' win rate, or the mean winning margin
+        """
+
+        if statistic == "win_rate":
+            rate, low, high = self.win_rate("0", z)
+            return (high - low) / 2.0
+        else:
+            return self.margin.half_width(z)
+
+
+    def report_lines (self):
+        """
+        generate the lines of a text report of the statistics
+        """
+
+        for index in sorted(self.wins):
+            yield "win_rate %s %.4f [%.4f, %.4f]" % ((index,) + self.win_rate(index))
+
+        yield "mean_turns %.2f" % self.mean_turns()
+        yield "margin %.2f +/- %.2f" % (self.margin.mean, math.sqrt(self.margin_variance()))
+        yield "turns " + " ".join(["%d:%d" % (n_turn, count) for n_turn, count in enumerate(self.turns) if count > 0])
+
+        for (side, event), (count, total) in sorted(self.effects.items()):
+            yield "effect %d %s %d %d" % (side, json.dumps(event), count, total)
+
+
+class Simulation:
+    """
+    representation for the game simulation
+    """
+
+    def __init__ (self, scenario, max_iterations, seed=None, workers=1, events="full", event_sink=None, half_width=None, statistic="win_rate", batch_size=1000, progress=None, first_game=0):
+        """
+        with a target HALF_WIDTH, simulate() runs batches of games until
+        the confidence interval on the given statistic is that narrow,
+        playing at most MAX_ITERATIONS games; progress gets written to
+        the PROGRESS file after each batch; game ids count up from
+        FIRST_GAME, so that the shards of one run never share an id
+        """
+
+        if isinstance(scenario, basestring):
+            scenario = load_scenario(scenario)
+
+        if statistic not in Statistics.STATISTICS:
+            raise ValueError("unknown statistic: %s" % repr(statistic))
+
+        if batch_size < 1:
+            raise ValueError("batch size must be at least 1, not %d" % batch_size)
+
+        retention, _, capacity = events.partition(":")
+
+        if (retention == "ring") and not (capacity.isdigit() and int(capacity) > 0):
+            raise ValueError("ring retention needs a capacity, as ring:N with N >= 1")
+
+        self.scenario = scenario
+        self.max_iterations = max_iterations
+        self.seed = seed
+        self.workers = workers
+        self.events = events
+        self.event_sink = event_sink
+        self.half_width = half_width
+        self.statistic = statistic
+        self.batch_size = batch_size
+        self.progress = progress
+        self.stats = Statistics(scenario)
+        self.game_ids = itertools.count(first_game)
+        self.n_dispatched = 0
+
+
+    def shards (self, max_iterations, master, first=0):
+        """
+        partition the iterations into one shard per worker, each with
+        its own RNG seed derived from the master RNG, and its own range
+        of game ids following those already dispatched
+        """
+
+        shards = []
+
+        for i, n in enumerate(shard_sizes(max_iterations, self.workers)):
+            event_sink = self.event_sink
+
+            if event_sink and ((self.workers > 1) or (self.half_width is not None)):
+                # each shard streams to its own file
+                event_sink = "%s.%d" % (event_sink, first + i)
+
+            shards.append((self.scenario, n, master.getrandbits(64), self.events, event_sink, self.n_dispatched))
+            self.n_dispatched += n
+
+        return shards
+
+
+    def simulate (self):
+        """
+        iterate through N games to collect statistics, or else until
+        the target half-width gets reached
+        """
+
+        master = random.Random(self.seed)
+        pool = worker_pool(self.workers)
+
+        try:
+            if self.half_width is None:
+                self.run_shards(pool, self.shards(self.max_iterations, master))
+            else:
+                first = 0
+
+                while self.stats.games < self.max_iterations:
+                    n = min(self.batch_size, self.max_iterations - self.stats.games)
+                    shards = self.shards(n, master, first)
+                    first += len(shards)
+
+                    self.run_shards(pool, shards)
+                    half_width = self.stats.half_width(self.statistic)
+
+                    if self.progress:
+                        rate, low, high = self.stats.win_rate()
+                        self.progress.write("games %d  win_rate %.4f [%.4f, %.4f]  %s +/- %.4f\n" % (self.stats.games, rate, low, high, self.statistic, half_width))
+                        self.progress.flush()
+
+                    if half_width <= self.half_width:
+                        break
+        finally:
+            close_pool(pool)
+
+
+    def run_shards (self, pool, shards):
+        """
+        play the shards, in the process pool if any, merging their statistics
+        """
+
+        for stats in map_shards(pool, run_shard, shards):
+            self.stats.merge(stats)
+
+
+    def stream (self, max_iterations, rng, final_only=True):
+        """
+        generator which plays N games, drawing from the given RNG, and
+        yields each game with its outcome -- per turn, or by default
+        only the final outcome; no references get kept to finished
+        games, so memory stays flat however many get played
+        """
+
+        retention, _, capacity = self.events.partition(":")
+        sink = None
+
+        if self.event_sink:
+            sink = open_sink(self.event_sink)
+
+        try:
+            for i in xrange(0, max_iterations):
+                events = EventLog(next(self.game_ids), retention, int(capacity or 0), sink, self.stats)
+
+                for game, outcome in Game(self.scenario, self, rng, events).stream(final_only):
+                    yield game, outcome
+        finally:
+            if sink:
+                sink.close()
+
+
+    def play (self, max_iterations, rng):
+        """
+        play N games, drawing from the given RNG
+        """
+
+        for game, outcome in self.stream(max_iterations, rng, final_only=not trace.turns):
+            if trace.turns:
+                for line in game.report_lines(outcome):
+                    trace.emit("turns", line)
+
+            if outcome["game_over"]:
+                self.stats.add(outcome)
+
+
+    def report (self):
+        """
+        report summary statistics for the simulation
+        """
+
+        print self.stats.wins["0"] / float(self.stats.games)
+
+        for condition, count in sorted(self.stats.ends.items()):
+            print condition, count
+
+        for line in self.stats.report_lines():
+            print line
+
+
+class PairedSimulation:
+    """
+    paired games across two or more variants of a scenario, using
+    common random numbers: game i of every variant gets the same seed,
+    and each player draws cards and rolls dice from substreams of that
+    seed, so the games only diverge where the variants differ -- the
+    differences from the first variant then have far less variance
+    than between independent runs
+    """
+
+    def __init__ (self, scenarios, max_iterations, seed=None, workers=1):
+        self.scenarios = [load_scenario(scenario) if isinstance(scenario, basestring) else scenario for scenario in scenarios]
+        self.max_iterations = max_iterations
+        self.seed = seed
+        self.workers = workers
+
+        # per variant: the full statistics, plus the founders' wins (as
+        # 0 or 1) and their margin (negative for a loss)
+
+        self.stats = [Statistics(scenario) for scenario in self.scenarios]
+        self.wins = [RunningStats() for scenario in self.scenarios]
+        self.margins = [RunningStats() for scenario in self.scenarios]
+
+        # per variant after the first: the paired differences from the first
+
+        self.win_diffs = [RunningStats() for scenario in self.scenarios[1:]]
+        self.margin_diffs = [RunningStats() for scenario in self.scenarios[1:]]
+
+
+    def simulate (self):
+        """
+        play N paired games of each variant, partitioned into one shard
+        per worker, each with its own seed derived from the master seed
+        """
+
+        master = random.Random(self.seed)
+        shards = [(self.scenarios, n, master.getrandbits(64)) for n in shard_sizes(self.max_iterations, self.workers)]
+        pool = worker_pool(self.workers)
+
+        try:
+            for paired in map_shards(pool, run_paired_shard, shards):
+                self.merge(paired)
+        finally:
+            close_pool(pool)
+
+
+    def play (self, max_iterations, rng):
+        """
+        play N paired games, with the seed for each drawn from the given RNG
+        """
+
+        for i in xrange(0, max_iterations):
+            substreams = rng.getrandbits(64)
+            wins = []
+            margins = []
+
+            for scenario, stats in zip(self.scenarios, self.stats):
+                events = EventLog(next(Game.game_ids), "off", 0, None, stats)
+                game = Game(scenario, None, random.Random(substreams), events, substreams)
+
+                for game, outcome in game.stream(final_only=True):
+                    stats.add(outcome)
+
+                end = outcome["end"]
+                win = stats.sides[end["winner"]] == "0"
+                wins.append(1.0 if win else 0.0)
+                margins.append(end["margin"] if win else -end["margin"])
+
+            for v in xrange(0, len(self.scenarios)):
+                self.wins[v].add(wins[v])
+                self.margins[v].add(margins[v])
+
+                if v > 0:
+                    self.win_diffs[v - 1].add(wins[v] - wins[0])
+                    self.margin_diffs[v - 1].add(margins[v] - margins[0])
+
+
+    def merge (self, other):
+        """
+        merge the statistics from another (partial) paired simulation
+        """
+
+        for mine, theirs in zip(self.stats + self.wins + self.margins + self.win_diffs + self.margin_diffs,
+                                other.stats + other.wins + other.margins + other.win_diffs + other.margin_diffs):
+            mine.merge(theirs)
+
+
+    def report_lines (self, z=1.96):
+        """
+        generate the lines of a text report, with the half-width of each
+        paired difference next to what independent runs would give
+        """
+
+        for v in xrange(0, len(self.scenarios)):
+            yield "variant %d  win_rate %.4f  margin %.2f" % (v, self.wins[v].mean, self.margins[v].mean)
+
+        for v in xrange(1, len(self.scenarios)):
+            n = float(self.wins[0].n)
+
+            for name, diffs, base in [("win_rate", self.win_diffs, self.wins), ("margin", self.margin_diffs, self.margins)]:
+                independent = z * math.sqrt((base[0].variance() + base[v].variance()) / n)
+                yield "variant %d - 0  %s %+.4f +/- %.4f paired, +/- %.4f independent" % (v, name, diffs[v - 1].mean, diffs[v - 1].half_width(z), independent)
+
+
+    def report (self):
+        """
+        report the paired differences between the variants
+        """
+
+        for line in self.report_lines():
+            print line
+
+
+def shard_sizes (max_iterations, workers):
+    """
+    partition the iterations into one shard per worker, as evenly as possible
+    """
+
+    size, extra = divmod(max_iterations, workers)
+
+    return [size + (1 if i < extra else 0) for i in range(0, workers)]
+
+
+def worker_pool (workers):
+    """
+    a process pool for the shards, or None to play them in this process
+    """
+
+    if workers > 1:
+        return multiprocessing.Pool(workers)
+
+    return None
+
+
+def map_shards (pool, func, shards):
+    """
+    play the shards, in the process pool if any, returning their results in order
+    """
+
+    if pool:
+        return pool.map(func, shards)
+
+    return map(func, shards)
+
+
+def close_pool (pool):
+    """
+    shut down a process pool, if any
+    """
+
+    if pool:
+        pool.close()
+        pool.join()
+
+
+def run_paired_shard (shard):
+    """
+    play one shard of a paired simulation, returning its statistics
+    """
+
+    scenarios, max_iterations, seed = shard
+
+    paired = PairedSimulation(scenarios, max_iterations)
+    paired.play(max_iterations, random.Random(seed))
+
+    return paired
+
+
+def run_shard (shard):
+    """
+    play one shard of a simulation, returning its statistics -- defined
+    at module level, so that it can be used by a process pool
+    """
+
+    scenario, max_iterations, seed, events, event_sink, first_game = shard
+
+    sim = Simulation(scenario, max_iterations, events=events, event_sink=event_sink, first_game=first_game)
+    sim.play(max_iterations, random.Random(seed))
+    trace.flush()
+
+    return sim.stats
+
+
+######################################################################
+## unit tests
+
+class TestDice (unittest.TestCase):
+    """unit tests for compiled dice notation"""
+
+    NOTATIONS = [ "d10+1/20, >0", "d10/10, >0", "d10/10, >1", "d10, >2", "d10, >6", "d6*3-2, >=4" ]
+
+
+    def eval_roll (self, notation):
+        """the original regex + eval() formula for a dice roll"""
+
+        base = None
+        roll, cond = notation.split(", ")
+        m = re.compile("^d(\d+)(.*)$").match(roll)
+
+        if m:
+            base = random.randint(0, int(m.group(1)))
+
+            for op in re.findall("[\-\+\*\/]\d+", m.group(2)):
+                base = eval("%f %s %s" % (base, op[0], op[1:]))
+
+        return base, eval("%f %s" % (base, cond))
+
+
+    def test_same_rng_stream (self):
+        """compiled rolls match the eval() formula for the same RNG stream"""
+
+        for notation in self.NOTATIONS:
+            random.seed(118)
+            expected = [self.eval_roll(notation) for i in range(0, 500)]
+
+            random.seed(118)
+            observed = [roll_dice(notation) for i in range(0, 500)]
+
+            self.assertEqual(expected, observed)
+
+
+    def test_compile_once (self):
+        """each notation gets compiled only once"""
+
+        self.assertTrue(compile_dice("d10, >2") is compile_dice("d10, >2"))
+
+
+    def test_bad_notation (self):
+        """malformed notation gets rejected at compile time"""
+
+        self.assertRaises(ValueError, Dice, "10+1, >0")
+        self.assertRaises(ValueError, Dice, "d10, maybe")
+
+
+class TestDeck (unittest.TestCase):
+    """unit tests for drawing cards from a deck"""
+
+    def test_draw (self):
+        """cards get drawn until none are left, except for retry cards"""
+
+        once = Card("once", "d10, >0")
+        again = Card("again", "d10, >0", retry=True)
+        deck = Deck([once] * 5)
+
+        drawn = [deck.draw() for i in range(0, 5)]
+
+        self.assertEqual(drawn, [once] * 5)
+        self.assertEqual(len(deck), 0)
+
+        deck = Deck([once, again])
+
+        for i in range(0, 20):
+            deck.draw()
+
+        self.assertEqual(deck.cards[0:deck.size], [again])
+
+
+    def test_distribution (self):
+        """draws are weighted by the number of copies of each card"""
+
+        cards = [Card(str(i), "d10, >0", retry=True) for i in range(0, 2)]
+        deck = Deck([cards[0]] * 3 + [cards[1]])
+        rng = random.Random(118)
+
+        draws = [deck.draw(rng) for i in range(0, 4000)]
+        ratio = draws.count(cards[0]) / float(len(draws))
+
+        self.assertTrue(abs(ratio - 0.75) < 0.03)
+
+
+class TestEventLog (unittest.TestCase):
+    """unit tests for the event log"""
+
+    def record (self, events, n):
+        for i in range(0, n):
+            events.turn = i
+            events.record(i % 2, "Police", i, "event %d" % i)
+
+
+    def test_retention (self):
+        """retention keeps all events, the last N events, or none"""
+
+        events = EventLog(0, "full")
+        self.record(events, 10)
+        self.assertEqual([e.turn for e in events.records()], range(0, 10))
+
+        events = EventLog(0, "ring", 4)
+        self.record(events, 10)
+        self.assertEqual([e.delta for e in events.records()], [6, 7, 8, 9])
+        self.assertEqual(events.records().next().event, "event 6")
+
+        events = EventLog(0, "off")
+        self.record(events, 10)
+        self.assertEqual(list(events.records()), [])
+
+
+    def test_sink (self):
+        """every event streams to the sink, regardless of retention"""
+
+        sink = MemorySink()
+        events = EventLog(7, "off", sink=sink)
+        self.record(events, 10)
+
+        self.assertEqual(len(sink.events), 10)
+        self.assertEqual(sink.events[3], Event(7, 3, 1, "Police", 3, "event 3"))
+
+
+class TestTracer (unittest.TestCase):
+    """unit tests for tracing"""
+
+    def test_categories (self):
+        """only the enabled categories get collected"""
+
+        tracer = Tracer(batch_size=2)
+        tracer.enable(["forces"])
+
+        for i in range(0, 3):
+            if tracer.forces:
+                tracer.emit("forces", "add_forces", i)
+
+            if tracer.cards:
+                tracer.emit("cards", "never")
+
+        self.assertEqual(tracer.collected, ["forces\tadd_forces 0", "forces\tadd_forces 1"])
+
+        tracer.flush()
+        self.assertEqual(len(tracer.collected), 3)
+        self.assertRaises(ValueError, tracer.enable, ["nope"])
+
+
+    def test_event_categories (self):
+        """events raised by conditions get traced as conditions, not cards"""
+
+        traced = {}
+
+        for category in ["cards", "conditions"]:
+            trace.enable([category])
+            Simulation("tboo.json", 20).play(20, random.Random(118))
+            trace.close()
+
+            traced[category] = trace.collected
+            trace.collected = []
+
+        trace.enable([])
+
+        self.assertTrue(traced["conditions"])
+        self.assertTrue(all([("AMNESTY" in line) or ("RAGE" in line) for line in traced["conditions"]]))
+        self.assertFalse([line for line in traced["cards"] if ("AMNESTY" in line) or ("RAGE" in line)])
+
+
+class TestHexMap (unittest.TestCase):
+    """unit tests for the hex map"""
+
+    def setUp (self):
+        self.scenario = load_scenario("tboo.json")
+        self.map = self.scenario.map
+
+
+    def test_index (self):
+        """hexes can be found by coordinates, and neighbors follow verify_move"""
+
+        i = self.map.hex_at(5, 5)
+
+        self.assertEqual(self.map.sites[i], "Mid Plaza")
+        self.assertEqual(self.map.hex_at(5, 6), None)
+        self.assertEqual(sorted([self.map.geos[j] for j in self.map.neighbors[i]]), ["4,4", "4,6", "5,3", "5,7", "6,4", "6,6"])
+
+        for j in self.map.neighbors[i]:
+            self.assertTrue(verify_move(self.map.geos[i], self.map.geos[j]))
+
+
+    def test_totals (self):
+        """force totals follow moves, and games don't share changes"""
+
+        game_0 = Game(self.scenario)
+        game_1 = Game(self.scenario)
+
+        src = self.map.index["5,5"]
+        dst = self.map.index["4,4"]
+
+        game_0.forces.move("0", src, dst, 10)
+        game_0.forces.add("0", dst, -5)
+
+        self.assertEqual(game_0.founder.count_force(game_0), 95)
+        self.assertEqual(game_0.forces.forces["0"][dst], 5)
+        self.assertEqual(game_1.founder.count_force(game_1), 100)
+        self.assertEqual(self.map.forces["0"][dst], 0)
+        self.assertRaises(ValueError, game_0.forces.move, "0", dst, src, 10)
+
+
+class TestMovement (unittest.TestCase):
+    """unit tests for moving forces on the map"""
+
+    def setUp (self):
+        self.scenario = load_scenario("tboo.json")
+        self.map = self.scenario.map
+
+
+    def test_reachable (self):
+        """moves within K steps follow the legal moves, skipping sites with no access"""
+
+        src = self.map.index["5,5"]
+        reach = self.map.reachable([src], 1)
+
+        self.assertEqual(sorted([self.map.geos[j] for j in reach if reach[j] == 1]), ["4,4", "4,6", "5,3", "5,7", "6,4", "6,6"])
+
+        reach = self.map.reachable([src], 100)
+
+        self.assertEqual(len(reach), len([site for site in self.map.sites if site != HexMap.NO_ACCESS]))
+        self.assertFalse(self.map.index["1,5"] in reach)
+        self.assertEqual(reach[self.map.index["0,2"]], 5)
+
+
+    def test_movement_card (self):
+        """a movement card relocates forces without changing the totals"""
+
+        game = Game(self.scenario, rng=random.Random(118))
+        card = MovementCard("march", "d10/10, >0")
+
+        for i in range(0, 10):
+            card.execute(game, game.founder, game.fellows)
+
+        forces = game.forces.forces["0"]
+
+        self.assertEqual(game.founder.count_force(game), 100)
+        self.assertEqual(sum(forces), 100)
+        self.assertTrue(forces[self.map.index["5,5"]] < 100)
+        self.assertEqual(game.forces.occupied["0"], set([i for i, n in enumerate(forces) if n > 0]))
+
+
+    def test_movement_overflow (self):
+        """a roll over 1 moves at most the whole force on the source hex"""
+
+        game = Game(self.scenario, rng=random.Random(118))
+        card = MovementCard("march", "d10, >2")
+        src = self.map.index["5,5"]
+
+        card.execute(game, game.founder, game.founder)
+
+        forces = game.forces.forces["0"]
+
+        self.assertEqual(forces[src], 0)
+        self.assertEqual(sum(forces), 100)
+
+
+class TestScenario (unittest.TestCase):
+    """unit tests for compiled scenarios"""
+
+    def test_independent_games (self):
+        """games share the scenario definitions, but not their counters"""
+
+        scenario = load_scenario("tboo.json")
+        game_0 = Game(scenario)
+        game_1 = Game(scenario)
+
+        game_0.founder.pick_card()
+        game_0.founder.state.n_forces = 0
+
+        self.assertTrue(game_0.founder.meta is game_1.founder.meta)
+        self.assertTrue(game_0.founder.conditions is game_1.founder.conditions)
+        self.assertEqual(len(game_0.founder.deck) + 1, len(game_1.founder.deck))
+        self.assertEqual(game_1.founder.state.n_forces, 100)
+
+
+    def test_outcome_shape (self):
+        """the outcome for each player merges its config and its counters"""
+
+        game = Game(load_scenario("tboo.json"), Simulation("tboo.json", 1))
+        game.play_duplex()
+        outcome = game.materialize()
+
+        for field in ["side", "index", "forces_name", "comm", "poll", "rage", "init_force", "n_forces", "n_captive", "n_reserve", "n_deployed", "n_casualty"]:
+            self.assertTrue(field in outcome["0"])
+
+
+    def test_deltas (self):
+        """replaying the per-turn deltas reproduces the full outcome"""
+
+        scenario = load_scenario("tboo.json")
+
+        for seed in range(0, 20):
+            game = Game(scenario, Simulation(scenario, 1), random.Random(seed))
+            deltas = list(game.deltas())
+
+            self.assertTrue(deltas[-1].end is not None)
+            self.assertTrue(all([delta.end is None for delta in deltas[:-1]]))
+            self.assertEqual(materialize(scenario, deltas), game.materialize())
+
+            for delta in deltas:
+                for side, field, value in delta.changes:
+                    self.assertTrue(field in PlayerState.__slots__)
+
+
+    def test_validate (self):
+        """a config missing required fields gets rejected"""
+
+        with open("tboo.json", "r") as f:
+            conf = json.load(f)
+
+        del conf["player1"]["cards"][0]["dice"]
+        self.assertRaises(ValueError, Scenario, conf)
+
+
+    def test_registry (self):
+        """card kinds come from the registry, and event names may hold quotes"""
+
+        with open("tboo.json", "r") as f:
+            conf = json.load(f)
+
+        conf["player0"]["cards"][0]["event"] = 'captured "Mayor" Kwon'
+        scenario = Scenario(conf)
+        card = scenario.players["player0"]["deck"][0]
+
+        self.assertTrue(isinstance(card, ForceReductionCard))
+        self.assertEqual(card.event, 'captured "Mayor" Kwon')
+        self.assertFalse(card.retry)
+
+        conf["player0"]["cards"][0]["kind"] = "NoSuchCard"
+        self.assertRaises(ValueError, Scenario, conf)
+
+
+class TestPreventDraw (unittest.TestCase):
+    """unit tests for stalemate detection"""
+
+    def setUp (self):
+        self.scenario = load_scenario("tboo.json")
+
+
+    def test_quiet_turns (self):
+        """the running count of quiet turns agrees with the log"""
+
+        rng = random.Random(118)
+
+        for i in range(0, 50):
+            game = Game(self.scenario, Simulation(self.scenario, 1), rng)
+
+            for g, outcome in game:
+                for player in [game.founder, game.fellows]:
+                    active = set([event.turn for event in game.events.records() if event.side == player.side])
+                    self.assertEqual(player.n_quiet, game.events.turn - len(active))
+
+
+    def test_window_bounded (self):
+        """the window of recent states stays bounded by len_stalemate"""
+
+        game = Game(self.scenario, Simulation(self.scenario, 1), random.Random(118))
+
+        for g, outcome in game:
+            self.assertTrue(len(game.last_full_meta) <= self.scenario.outcome["len_stalemate"])
+
+
+class TestSimulation (unittest.TestCase):
+    """unit tests for running a simulation"""
+
+    def test_stream (self):
+        """games stream per turn, or only their final outcomes, with integer ids"""
+
+        sim = Simulation("tboo.json", 20)
+        finals = [(game.game_id, outcome["n_turn"], outcome["end"]) for game, outcome in sim.stream(20, random.Random(118))]
+
+        self.assertEqual(len(finals), 20)
+        self.assertEqual(len(set([game_id for game_id, n_turn, end in finals])), 20)
+
+        turns = []
+
+        for game, outcome in sim.stream(20, random.Random(118), final_only=False):
+            turns.append(outcome["game_id"])
+
+            if outcome["game_over"]:
+                self.assertEqual((outcome["n_turn"], outcome["end"]), finals.pop(0)[1:])
+
+        self.assertEqual(finals, [])
+        self.assertTrue(all([isinstance(game_id, int) for game_id in turns]))
+
+
+    def test_seeded_workers (self):
+        """the same seed and worker count produce identical totals"""
+
+        totals = []
+
+        for i in range(0, 2):
+            sim = Simulation("tboo.json", 40, seed=118, workers=2)
+            sim.simulate()
+            totals.append((sim.stats.wins, sim.stats.ends, sim.stats.effects))
+
+        self.assertEqual(totals[0], totals[1])
+        self.assertEqual(sum(totals[0][1].values()), 40)
+
+
+    def test_shard_game_ids (self):
+        """the shards of one run stream games with distinct ids"""
+
+        sim = Simulation("tboo.json", 10, seed=118, workers=3, events="ring:4")
+        shards = sim.shards(10, random.Random(118)) + sim.shards(5, random.Random(118), 3)
+        game_ids = []
+
+        for scenario, n, seed, events, event_sink, first_game in shards:
+            shard = Simulation(scenario, n, events=events, first_game=first_game)
+            game_ids.extend([game.game_id for game, outcome in shard.stream(n, random.Random(seed))])
+
+        self.assertEqual(game_ids, range(0, 15))
+        self.assertRaises(ValueError, Simulation, "tboo.json", 10, events="ring")
+        self.assertRaises(ValueError, EventLog, 0, "ring")
+
+
+    def test_early_stopping (self):
+        """an adaptive run stops once the interval is narrow enough, or at the cap"""
+
+        sim = Simulation("tboo.json", 5000, seed=118, half_width=0.05, batch_size=100)
+        sim.simulate()
+
+        self.assertTrue(sim.stats.games < 5000)
+        self.assertEqual(sim.stats.games % 100, 0)
+        self.assertTrue(sim.stats.half_width() <= 0.05)
+
+        sim = Simulation("tboo.json", 250, seed=118, half_width=0.001, batch_size=100)
+        sim.simulate()
+
+        self.assertEqual(sim.stats.games, 250)
+        self.assertRaises(ValueError, Simulation, "tboo.json", 250, half_width=0.05, batch_size=0)
+
+
+    def test_paired (self):
+        """paired variants share their random numbers, so the differences have less variance"""
+
+        with open("tboo.json", "r") as f:
+            conf = json.load(f)
+
+        base = Scenario(conf)
+        conf["player0"]["cards"][0]["dice"] = "d10/20, >0"
+        variant = Scenario(conf)
+
+        paired = PairedSimulation([base, base], 300, seed=118)
+        paired.simulate()
+
+        self.assertEqual(paired.win_diffs[0].m2, 0.0)
+        self.assertEqual(paired.margin_diffs[0].mean, 0.0)
+        self.assertEqual(paired.stats[0].ends, paired.stats[1].ends)
+
+        paired = PairedSimulation([base, variant], 300, seed=118, workers=2)
+        paired.simulate()
+
+        self.assertEqual(paired.wins[1].n, 300)
+        self.assertTrue(paired.win_diffs[0].variance() < paired.wins[0].variance() + paired.wins[1].variance())
+        self.assertTrue(paired.margin_diffs[0].variance() < paired.margins[0].variance() + paired.margins[1].variance())
+
+
+    def test_statistics (self):
+        """statistics count each winner, and merge like one larger run"""
+
+        scenario = load_scenario("tboo.json")
+        parts = []
+
+        for seed in range(0, 3):
+            sim = Simulation(scenario, 200)
+            sim.play(200, random.Random(seed))
+            parts.append(sim.stats)
+
+        whole = Statistics(scenario)
+        margins = []
+
+        for seed in range(0, 3):
+            for game, outcome in Simulation(scenario, 200).stream(200, random.Random(seed)):
+                whole.add(outcome)
+                margins.append(outcome["end"]["margin"])
+
+        merged = Statistics(scenario)
+
+        for stats in parts:
+            merged.merge(stats)
+
+        mean = sum(margins) / float(len(margins))
+        variance = sum([(m - mean) ** 2 for m in margins]) / (len(margins) - 1)
+
+        self.assertEqual(merged.games, 600)
+        self.assertEqual((merged.wins, merged.ends, list(merged.turns)), (whole.wins, whole.ends, list(whole.turns)))
+        self.assertTrue(0 < merged.wins["1"] < merged.wins["0"])
+        self.assertAlmostEqual(merged.margin.mean, mean)
+        self.assertAlmostEqual(merged.margin_variance(), variance)
+        self.assertAlmostEqual(whole.margin_variance(), variance)
+
+        rate, low, high = merged.win_rate("0")
+        self.assertTrue(low < rate < high)
+        self.assertTrue(merged.effects)
+        self.assertTrue(all([count > 0 for count, total in merged.effects.values()]))
+
+
+######################################################################
+## command line interface
+
+if __name__ == "__main__":
+    if (len(sys.argv) > 1) and (sys.argv[1] == "test"):
+        # run unit tests
+        del sys.argv[1]
+        unittest.main()
+
+    parser = optparse.OptionParser(usage="%prog [options] <scenario.json> <max_iterations>")
+    parser.add_option("--workers", type="int", default=1, help="number of worker processes")
+    parser.add_option("--seed", type="int", default=None, help="master seed for the RNG streams")
+    parser.add_option("--events", default=None, help="event retention per game: off, full (the default), or ring:N for the last N")
+    parser.add_option("--event-sink", default=None, help="stream events to jsonl:PATH or columnar:PREFIX")
+    parser.add_option("--half-width", type="float", default=None, help="stop once the confidence interval on the statistic is this narrow; max_iterations becomes a cap")
+    parser.add_option("--statistic", default="win_rate", help="statistic for --half-width: %s" % ", ".join(Statistics.STATISTICS))
+    parser.add_option("--batch-size", type="int", default=1000, help="games per batch between checks of --half-width")
+    parser.add_option("--compare", action="append", default=[], help="scenario variant to compare, in paired games with common random numbers; may be repeated")
+    parser.add_option("--trace", default="", help="trace categories, comma separated: %s" % ",".join(Tracer.CATEGORIES))
+    parser.add_option("--trace-file", default="trace.log", help="file for the trace output")
+
+    (options, args) = parser.parse_args()
+
+    if len(args) != 2:
+        parser.error("expected a scenario config and a number of iterations")
+
+    if options.batch_size < 1:
+        parser.error("--batch-size must be at least 1")
+
+    if options.compare and (options.events or options.event_sink or (options.half_width is not None)):
+        # paired games keep no events, and always play every iteration
+        parser.error("--compare does not support --events, --event-sink or --half-width")
+
+    if options.trace:
+        trace.enable(options.trace.split(","), options.trace_file)
+
+    file_conf = args[0]
+    max_iterations = int(args[1])
+
+    try:
+        if options.compare:
+            sim = PairedSimulation([file_conf] + options.compare, max_iterations, seed=options.seed, workers=options.workers)
+        else:
+            sim = Simulation(file_conf, max_iterations, seed=options.seed, workers=options.workers, events=options.events or "full", event_sink=options.event_sink, half_width=options.half_width, statistic=options.statistic, batch_size=options.batch_size, progress=sys.stderr)
+    except ValueError, ex:
+        parser.error(str(ex))
 
     sim.simulate()
     sim.report()
@@ -0,0 +1,311 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+# by Liber 118
+# http://liber118.com/
+# licensed under a Creative Commons Attribution-ShareAlike 3.0 Unported License
+# http://creativecommons.org/licenses/by-sa/3.0/
+
+# parameter sweeps over the fields of a scenario, run as:
+#   python sweep.py [options] <scenario.json> <sweep.json> <max_iterations>
+#
+# where the sweep config names the fields to override, by path, e.g.:
+#   { "grid": { "len_stalemate": [2, 3, 4], "player0.cards.ForceReductionCard.dice": ["d10/10, >0", "d10/20, >0"] } }
+#   { "random": { "max_turns": [10, 50, 100], "map.5,5.force.0": [50, 100, 200] }, "samples": 20 }
+
+
+import copy
+import hashlib
+import itertools
+import json
+import optparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import unittest
+
+import pygame
+
+
+######################################################################
+## scenario overrides
+
+def lookup (conf, segment):
+    """
+    resolve one segment of an override path: a key in a dict, or else
+    in a list either an index or the first item of that kind
+    """
+
+    if isinstance(conf, list):
+        if segment.isdigit():
+            return int(segment)
+
+        for i, item in enumerate(conf):
+            if item.get("kind") == segment:
+                return i
+
+        raise KeyError("no item of kind %s" % repr(segment))
+    elif segment in conf:
+        return segment
+    else:
+        raise KeyError("no field %s" % repr(segment))
+
+
+def apply_overrides (conf, overrides):
+    """
+    copy of a scenario config with values replaced, for each override
+    path of dot-separated segments, e.g., "player0.cards.0.dice"
+    """
+
+    conf = copy.deepcopy(conf)
+
+    for path, value in sorted(overrides.items()):
+        segments = path.split(".")
+        item = conf
+
+        for segment in segments[:-1]:
+            item = item[lookup(item, segment)]
+
+        item[lookup(item, segments[-1])] = value
+
+    return conf
+
+
+def grid_points (axes):
+    """
+    every combination of the values for each override path
+    """
+
+    paths = sorted(axes)
+
+    return [dict(zip(paths, values)) for values in itertools.product(*[axes[path] for path in paths])]
+
+
+def random_points (axes, samples, rng=random):
+    """
+    N combinations sampled at random from the values for each override path
+    """
+
+    paths = sorted(axes)
+
+    return [dict([(path, rng.choice(axes[path])) for path in paths]) for i in xrange(0, samples)]
+
+
+def sweep_points (sweep_conf, seed=None):
+    """
+    the override points for a sweep config, either a grid or a random sample
+    """
+
+    if "grid" in sweep_conf:
+        return grid_points(sweep_conf["grid"])
+    elif "random" in sweep_conf:
+        return random_points(sweep_conf["random"], sweep_conf.get("samples", 10), random.Random(seed))
+    else:
+        raise ValueError("sweep config needs either a 'grid' or a 'random' set of overrides")
+
+
+######################################################################
+## cached runs
+
+# statistics recorded for each point of a sweep, in column order
+
+RESULT_COLUMNS = ["games", "win_rate", "win_low", "win_high", "mean_turns", "margin_mean", "margin_sd"]
+
+
+def cache_key (conf, seed, max_iterations, workers):
+    """
+    hash of the effective scenario config, seed, iteration count, and
+    number of workers -- seeded results depend on how the games get
+    split into shards, one per worker
+    """
+
+    text = json.dumps([conf, seed, max_iterations, workers], sort_keys=True)
+
+    return hashlib.sha1(text).hexdigest()
+
+
+class Sweep:
+    """
+    representation for a parameter sweep over a base scenario config,
+    with the results for each point cached on disk -- only for a seeded
+    sweep, since an unseeded result cannot be reproduced anyway
+    """
+
+    def __init__ (self, base_conf, points, max_iterations, seed=None, workers=1, cache_dir=".sweep_cache"):
+        if isinstance(base_conf, basestring):
+            with open(base_conf, "r") as f:
+                base_conf = json.load(f)
+
+        self.base_conf = base_conf
+        self.points = points
+        self.max_iterations = max_iterations
+        self.seed = seed
+        self.workers = workers
+        self.cache_dir = cache_dir
+        self.n_cached = 0
+
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+
+
+    def run_point (self, overrides):
+        """
+        the results for one point of the sweep, from the cache if available
+        """
+
+        conf = apply_overrides(self.base_conf, overrides)
+        key = cache_key(conf, self.seed, self.max_iterations, self.workers)
+        path = os.path.join(self.cache_dir, key + ".json")
+        cached = self.seed is not None
+
+        if cached and os.path.exists(path):
+            self.n_cached += 1
+
+            with open(path, "r") as f:
+                return json.load(f)
+
+        sim = pygame.Simulation(pygame.Scenario(conf), self.max_iterations, seed=self.seed, workers=self.workers, events="off")
+        sim.simulate()
+
+        stats = sim.stats
+        rate, low, high = stats.win_rate()
+        result = dict(zip(RESULT_COLUMNS, [stats.games, rate, low, high, stats.mean_turns(), stats.margin.mean, stats.margin_variance() ** 0.5]))
+        result["key"] = key
+        result["ends"] = stats.ends
+
+        if cached:
+            # write then rename, so an interrupted sweep leaves no partial entries
+
+            with open(path + ".tmp", "w") as f:
+                json.dump(result, f)
+
+            os.rename(path + ".tmp", path)
+
+        return result
+
+
+    def run (self):
+        """
+        run every point of the sweep, returning the results as columns
+        """
+
+        paths = sorted(set([path for overrides in self.points for path in overrides]))
+        results = [self.run_point(overrides) for overrides in self.points]
+        ends = sorted(set([condition for result in results for condition in result["ends"]]))
+
+        columns = dict([(path, [overrides.get(path) for overrides in self.points]) for path in paths])
+        columns["key"] = [result["key"] for result in results]
+
+        for name in RESULT_COLUMNS:
+            columns[name] = [result[name] for result in results]
+
+        for condition in ends:
+            columns["end:" + condition] = [result["ends"].get(condition, 0) for result in results]
+
+        return { "columns": ["key"] + paths + RESULT_COLUMNS + ["end:" + condition for condition in ends], "data": columns }
+
+
+######################################################################
+## unit tests
+
+class TestSweep (unittest.TestCase):
+    """unit tests for parameter sweeps"""
+
+    def setUp (self):
+        with open("tboo.json", "r") as f:
+            self.conf = json.load(f)
+
+        self.cache_dir = tempfile.mkdtemp()
+
+
+    def tearDown (self):
+        shutil.rmtree(self.cache_dir)
+
+
+    def test_overrides (self):
+        """override paths reach top-level fields, list items by index or kind, and map hexes"""
+
+        conf = apply_overrides(self.conf, { "len_stalemate": 4, "player0.cards.ConversionCard.dice": "d6/10, >0", "player1.cards.0.num": 3, "map.5,5.force.0": 50 })
+
+        self.assertEqual(conf["len_stalemate"], 4)
+        self.assertEqual(conf["player0"]["cards"][1]["dice"], "d6/10, >0")
+        self.assertEqual(conf["player1"]["cards"][0]["num"], 3)
+        self.assertEqual(conf["map"]["5,5"]["force"]["0"], 50)
+        self.assertEqual(self.conf["len_stalemate"], 3)
+        self.assertRaises(KeyError, apply_overrides, self.conf, { "player0.cards.NoSuchCard.dice": "d6, >0" })
+
+
+    def test_points (self):
+        """a grid covers every combination, a random sample draws from the values"""
+
+        axes = { "len_stalemate": [2, 3, 4], "max_turns": [10, 100] }
+
+        self.assertEqual(len(grid_points(axes)), 6)
+        self.assertEqual(sweep_points({ "random": axes, "samples": 5 }, 118), sweep_points({ "random": axes, "samples": 5 }, 118))
+
+
+    def test_cache (self):
+        """re-running a sweep only computes the new points"""
+
+        points = grid_points({ "len_stalemate": [2, 3] })
+        sweep = Sweep(self.conf, points, 50, seed=118, cache_dir=self.cache_dir)
+        results = sweep.run()
+
+        self.assertEqual(sweep.n_cached, 0)
+        self.assertEqual(results["data"]["games"], [50, 50])
+
+        sweep = Sweep(self.conf, points + grid_points({ "len_stalemate": [4] }), 50, seed=118, cache_dir=self.cache_dir)
+
+        self.assertEqual(sweep.run()["data"]["win_rate"][:2], results["data"]["win_rate"])
+        self.assertEqual(sweep.n_cached, 2)
+
+
+    def test_uncached (self):
+        """the cache keys on the worker count, and an unseeded sweep never gets cached"""
+
+        self.assertNotEqual(cache_key(self.conf, 118, 50, 1), cache_key(self.conf, 118, 50, 2))
+
+        points = grid_points({ "len_stalemate": [2] })
+        Sweep(self.conf, points, 20, cache_dir=self.cache_dir).run()
+        sweep = Sweep(self.conf, points, 20, cache_dir=self.cache_dir)
+        sweep.run()
+
+        self.assertEqual(sweep.n_cached, 0)
+        self.assertEqual(os.listdir(self.cache_dir), [])
+
+
+######################################################################
+## command line interface
+
+if __name__ == "__main__":
+    if (len(sys.argv) > 1) and (sys.argv[1] == "test"):
+        # run unit tests
+        del sys.argv[1]
+        unittest.main()
+
+    parser = optparse.OptionParser(usage="%prog [options] <scenario.json> <sweep.json> <max_iterations>")
+    parser.add_option("--workers", type="int", default=1, help="number of worker processes")
+    parser.add_option("--seed", type="int", default=None, help="master seed, shared by every point of the sweep")
+    parser.add_option("--cache-dir", default=".sweep_cache", help="directory for the cached results of each point")
+    parser.add_option("--output", default="sweep.json", help="file for the results, as one column per field")
+
+    (options, args) = parser.parse_args()
+
+    if len(args) != 3:
+        parser.error("expected a scenario config, a sweep config, and a number of iterations")
+
+    with open(args[1], "r") as f:
+        sweep_conf = json.load(f)
+
+    if options.seed is None:
+        sys.stderr.write("no --seed, so the results cannot be reproduced, and do not get cached\n")
+
+    sweep = Sweep(args[0], sweep_points(sweep_conf, options.seed), int(args[2]), seed=options.seed, workers=options.workers, cache_dir=options.cache_dir)
+    results = sweep.run()
+
+    with open(options.output, "w") as f:
+        json.dump(results, f)
+
+    print "%d points, %d from the cache, written to %s" % (len(sweep.points), sweep.n_cached, options.output)
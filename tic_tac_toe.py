@@ -7,36 +7,650 @@
 # http://creativecommons.org/licenses/by-sa/3.0/
 
 
+import array
+import collections
+import heapq
 import logging
+import operator
+import random
 import sys
+import time
 import unittest
 
 
 class TestChooseMoves (unittest.TestCase):
-    """unit tests for AI"""
+    """unit tests for AI, with each board engine"""
 
     def setUp (self):
-        self.t3 = TicTacToe()
+        self.games = [TicTacToe(board_class=board_class) for board_class in [SpanBoard, BitBoard]]
 
 
     def test_ai_wins (self):
         """force a condition where the AI should win this turn"""
 
-        self.t3.board = ['O', 'X', ' ', 'X', 'O', ' ', ' ', ' ', ' ']
-        you_win, game_over, stimulus_ai = self.t3.player_takes_turn(6, 'X', 'O')
+        for t3 in self.games:
+            t3.board = ['O', 'X', ' ', 'X', 'O', ' ', ' ', ' ', ' ']
+            you_win, game_over, stimulus_ai = t3.player_takes_turn(6, 'X', 'O')
 
-        self.assertFalse(you_win)
-        self.assertTrue(game_over)
+            self.assertFalse(you_win)
+            self.assertTrue(game_over)
+            self.assertTrue(t3.board.won('O'))
+            self.assertTrue(isinstance(t3.board, t3.board_class))
 
 
     def test_player_wins (self):
         """force a condition where the player should win this turn"""
 
-        self.t3.board = ['O', 'X', ' ', 'O', 'X', ' ', ' ', ' ', ' ']
-        you_win, game_over, stimulus_ai = self.t3.player_takes_turn(7, 'X', 'O')
+        for t3 in self.games:
+            t3.board = ['O', 'X', ' ', 'O', 'X', ' ', ' ', ' ', ' ']
+            you_win, game_over, stimulus_ai = t3.player_takes_turn(7, 'X', 'O')
 
-        self.assertTrue(you_win)
-        self.assertTrue(game_over)
+            self.assertTrue(you_win)
+            self.assertTrue(game_over)
+
+
+class TestSpanTable (unittest.TestCase):
+    """unit tests for the precomputed spans"""
+
+    def test_spans (self):
+        """the table lists every span of the board, in the order of the original scan"""
+
+        t3 = TicTacToe(board_size=4, span_length=3)
+        spans = list(t3.generate_spans())
+
+        self.assertEqual(len(spans), 24)
+        self.assertEqual(spans[:4], [[0, 1, 2], [0, 4, 8], [0, 5, 10], [1, 2, 3]])
+        self.assertEqual(spans[-1], [13, 10, 7])
+
+
+    def test_shared (self):
+        """instances of the same dimensions share one table"""
+
+        self.assertTrue(TicTacToe(5, 4).spans is TicTacToe(5, 4).spans)
+        self.assertFalse(TicTacToe(5, 4).spans is TicTacToe(5, 3).spans)
+
+
+    def test_cell_index (self):
+        """each cell maps to exactly the spans which pass through it"""
+
+        table = span_table(6, 4)
+
+        for cell in range(0, 36):
+            expected = [k for k in range(0, table.n_spans) if cell in table.span(k)]
+            self.assertEqual(list(table.spans_through(cell)), expected)
+
+
+class SpanTable:
+    """precomputed spans for one (board_size, span_length), as flat integer arrays"""
+
+    TRANSFORMS = [(1, 0), (0, 1), (1, 1), (1, -1)]
+
+
+    def __init__ (self, board_size, span_length):
+        """collect every span once, plus an inverted index from each cell to its spans"""
+
+        self.board_size = board_size
+        self.span_length = span_length
+        self.max_index = board_size ** 2
+
+        # span k covers cells[k * span_length : (k + 1) * span_length];
+        # NB: as with the original scan, a span needs at least two cells
+
+        self.cells = array.array("i")
+
+        for i in range(0, self.max_index if span_length > 1 else 0):
+            for dx, dy in self.TRANSFORMS:
+                x = i % board_size
+                y = i / board_size
+                x_end = x + dx * (span_length - 1)
+                y_end = y + dy * (span_length - 1)
+
+                if (0 <= x_end < board_size) and (0 <= y_end < board_size):
+                    self.cells.extend([(y + dy * j) * board_size + (x + dx * j) for j in range(0, span_length)])
+
+        self.n_spans = len(self.cells) / span_length
+
+        # the spans through cell i are cell_spans[cell_offsets[i] : cell_offsets[i + 1]]
+
+        through = [[] for i in range(0, self.max_index)]
+
+        for k in range(0, self.n_spans):
+            for i in self.span(k):
+                through[i].append(k)
+
+        self.cell_offsets = array.array("i", [0])
+        self.cell_spans = array.array("i")
+
+        for spans in through:
+            self.cell_spans.extend(spans)
+            self.cell_offsets.append(len(self.cell_spans))
+
+        # each span as a bitmask over the cells, for the bitboards
+
+        self.masks = [sum([1 << i for i in self.span(k)]) for k in range(0, self.n_spans)]
+
+
+    def span (self, k):
+        """the cells of span k"""
+
+        return self.cells[k * self.span_length:(k + 1) * self.span_length]
+
+
+    def spans_through (self, i):
+        """the spans which pass through cell i"""
+
+        return self.cell_spans[self.cell_offsets[i]:self.cell_offsets[i + 1]]
+
+
+_span_tables = {}
+
+def span_table (board_size, span_length):
+    """get the span table for a board, computed once per (board_size, span_length)"""
+
+    key = (board_size, span_length)
+
+    if key not in _span_tables:
+        _span_tables[key] = SpanTable(board_size, span_length)
+
+    return _span_tables[key]
+
+
+class TestSymmetries (unittest.TestCase):
+    """unit tests for the board symmetries and the position cache"""
+
+    def test_permutations (self):
+        """each board size has 8 distinct permutations of its cells, with their inverses"""
+
+        sym = symmetries(4)
+
+        self.assertEqual(len(set(sym.perms)), 8)
+        self.assertTrue(symmetries(4) is sym)
+
+        for perm, inverse in zip(sym.perms, sym.inverse):
+            self.assertEqual(sorted(perm), range(0, 16))
+            self.assertEqual([perm[j] for j in inverse], range(0, 16))
+
+
+    def test_canonical (self):
+        """rotations and reflections of a board share a canonical key, which maps moves back"""
+
+        sym = symmetries(3)
+        board = ['X', ' ', ' ', ' ', 'O', ' ', ' ', 'X', ' ']
+        key, s = sym.canonical(board)
+
+        for perm in sym.perms:
+            image = [board[i] for i in perm]
+            image_key, image_s = sym.canonical(image)
+
+            self.assertEqual(image_key, key)
+
+            for move in range(0, 9):
+                # a move on the image lands on the same cell of the canonical board
+                self.assertEqual(sym.inverse[image_s][move], sym.inverse[s][perm[move]])
+
+
+    def test_cache (self):
+        """the search AI answers a rotated position from its cache, in that position's orientation"""
+
+        t3 = TicTacToe(ai_class=SearchAI)
+        t3.board = ['X', ' ', ' ', ' ', ' ', ' ', ' ', ' ', ' ']
+        move = t3.ai.search(t3.O_MARK, t3)
+
+        self.assertEqual(t3.ai.cache.hits, 0)
+        self.assertEqual(move, 4)
+
+        t3.board = [' ', ' ', ' ', ' ', 'O', ' ', ' ', ' ', ' ']
+        sym = symmetries(3)
+        replies = set()
+
+        for corner in [0, 2, 6, 8]:
+            t3.board[corner] = 'X'
+            move = t3.ai.search(t3.X_MARK, t3)
+
+            self.assertEqual(t3.board[move], ' ')
+            t3.board[move] = 'X'
+            replies.add(sym.canonical(t3.board)[0])
+            t3.board[move] = ' '
+            t3.board[corner] = ' '
+
+        self.assertEqual(len(replies), 1)
+        self.assertEqual(t3.ai.cache.hits, 3)
+        self.assertEqual((t3.ai.nodes, t3.ai.depth), (0, 0))
+
+
+    def test_pruned (self):
+        """a search which skipped moves does not get cached, even once decided"""
+
+        t3 = TicTacToe(board_size=7, span_length=4, ai_class=SearchAI)
+
+        for i in [24, 25, 26]:
+            t3.board[i] = 'O'
+
+        move = t3.ai.search(t3.O_MARK, t3)
+
+        self.assertTrue(move in [23, 27])
+        self.assertTrue(t3.ai.pruned)
+        self.assertEqual(len(t3.ai.cache.memo), 0)
+
+
+    def test_bounded (self):
+        """the cache holds at most its size, evicting the least recently used"""
+
+        cache = PositionCache(symmetries(3), 2)
+
+        for i in range(0, 4):
+            board = [' '] * 9
+            board[[0, 1, 4, 8][i]] = 'X'
+            cache.put(board, 'O', 4, i)
+
+        self.assertEqual(len(cache.memo), 2)
+        self.assertEqual(cache.evictions, 2)
+        self.assertEqual(cache.get(['X'] + [' '] * 8, 'O'), (4, 3))
+        self.assertEqual(cache.get([' ', 'X'] + [' '] * 7, 'O'), None)
+
+
+class Symmetries:
+    """the 8 rotations and reflections of a square board, as permutations of its cells"""
+
+    def __init__ (self, board_size):
+        """precompute the permutations, and their inverses"""
+
+        self.board_size = board_size
+        m = board_size - 1
+
+        transforms = [
+            lambda x, y: (x, y), lambda x, y: (m - y, x), lambda x, y: (m - x, m - y), lambda x, y: (y, m - x),
+            lambda x, y: (m - x, y), lambda x, y: (y, x), lambda x, y: (x, m - y), lambda x, y: (m - y, m - x)
+            ]
+
+        # the image of a board under symmetry s is [board[i] for i in perms[s]],
+        # so a move j on the image is the move perms[s][j] on the board, and
+        # a move i on the board is the move inverse[s][i] on the image
+
+        self.perms = []
+        self.inverse = []
+
+        for transform in transforms:
+            perm = [0] * board_size ** 2
+
+            for y in range(0, board_size):
+                for x in range(0, board_size):
+                    tx, ty = transform(x, y)
+                    perm[ty * board_size + tx] = y * board_size + x
+
+            inverse = [0] * len(perm)
+
+            for j, i in enumerate(perm):
+                inverse[i] = j
+
+            self.perms.append(tuple(perm))
+            self.inverse.append(tuple(inverse))
+
+        self.getters = [operator.itemgetter(*perm) for perm in self.perms]
+
+
+    def canonical (self, board):
+        """the canonical key for a board, as the least of its images, plus the symmetry which gives it"""
+
+        # NB: spans run along rows, columns, and both diagonals, so every
+        # image of a board has the same analysis, up to the mapping of moves
+
+        images = [(getter(board), s) for s, getter in enumerate(self.getters)]
+
+        return min(images)
+
+
+_symmetries = {}
+
+def symmetries (board_size):
+    """get the symmetries for a board, computed once per board_size"""
+
+    if board_size not in _symmetries:
+        _symmetries[board_size] = Symmetries(board_size)
+
+    return _symmetries[board_size]
+
+
+class PositionCache:
+    """memo of analysis results (best move, value) per canonical position, with LRU eviction"""
+
+    CACHE_SIZE = 1 << 14
+
+
+    def __init__ (self, sym, cache_size=None):
+        """set the symmetries for the board, and the maximum number of positions"""
+
+        self.sym = sym
+        self.cache_size = cache_size or self.CACHE_SIZE
+        self.memo = collections.OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+
+    def get (self, board, player):
+        """the (best move, value) for the player to move, in the orientation of this board, or None"""
+
+        image, s = self.sym.canonical(board)
+        key = (player, image)
+        result = self.memo.get(key)
+
+        if result is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self.memo[key] = self.memo.pop(key)
+        move, value = result
+
+        return self.sym.perms[s][move], value
+
+
+    def put (self, board, player, move, value):
+        """store the (best move, value) for the player to move on this board"""
+
+        image, s = self.sym.canonical(board)
+        self.memo[(player, image)] = (self.sym.inverse[s][move], value)
+
+        if len(self.memo) > self.cache_size:
+            self.memo.popitem(last=False)
+            self.evictions += 1
+
+
+class TestBoards (unittest.TestCase):
+    """unit tests for the board engines, each checked against scanning every span"""
+
+    def engines (self, board_size, span_length):
+        return [TicTacToe(board_size=board_size, span_length=span_length, board_class=board_class) for board_class in [SpanBoard, BitBoard]]
+
+
+    def assertScanned (self, t3):
+        for player in [t3.X_MARK, t3.O_MARK]:
+            self.assertEqual(t3.get_best_span(player), t3.scan_best_span(player))
+            self.assertEqual(t3.board.won(player), t3.scan_best_span(player)[0] == t3.span_length)
+
+
+    def test_best_span (self):
+        """the engines give the same best span as scanning the board, as marks get placed and cleared"""
+
+        for t3 in self.engines(7, 4):
+            rng = random.Random(118)
+
+            for n in range(0, 200):
+                t3.board[rng.randrange(0, t3.max_index)] = rng.choice([t3.X_MARK, t3.O_MARK, t3.BLANK])
+                self.assertScanned(t3)
+
+
+    def test_replaced_board (self):
+        """a board assigned as a plain list gets counted on the next query"""
+
+        for t3 in self.engines(3, 3):
+            t3.board = ['O', 'X', ' ', 'X', 'O', ' ', ' ', ' ', ' ']
+
+            self.assertEqual(t3.get_best_span(t3.O_MARK), (2, [['O', 'O', ' ']], [[0, 4, 8]]))
+            self.assertTrue(isinstance(t3.board, t3.board_class))
+
+
+    def test_slices (self):
+        """slice assignments update the engine, and nothing changes the size of the board"""
+
+        for t3 in self.engines(5, 3):
+            board = t3.sync_board()
+
+            board[0:3] = ['X', 'X', 'X']
+            self.assertTrue(board.won('X'))
+
+            board[::6] = ['O'] * 5
+            board[-1] = 'X'
+            board.reverse()
+            self.assertEqual(board[0], 'X')
+            self.assertScanned(t3)
+
+            self.assertRaises(ValueError, board.__setitem__, slice(0, 2), ['X'])
+            self.assertRaises(TypeError, board.append, 'X')
+            self.assertRaises(TypeError, board.pop)
+            self.assertRaises(TypeError, board.__delslice__, 0, 2)
+            self.assertEqual(len(board), 25)
+
+
+class MarkBoard (list):
+    """a board as a fixed-size list of marks, where every change of a cell goes through set_mark()"""
+
+    def __setitem__ (self, i, mark):
+        """set the mark in a cell, or the marks in a slice of cells of the same length"""
+
+        if isinstance(i, slice):
+            cells = range(*i.indices(len(self)))
+            marks = list(mark)
+
+            if len(marks) != len(cells):
+                raise ValueError("the board has a fixed size, so %d marks cannot replace %d cells" % (len(marks), len(cells)))
+
+            for j, mark in zip(cells, marks):
+                self.set_mark(j, mark)
+        else:
+            if i < 0:
+                i += len(self)
+
+            self.set_mark(i, mark)
+
+
+    def __setslice__ (self, i, j, marks):
+        """on Python 2, a simple slice assignment bypasses __setitem__"""
+
+        self.__setitem__(slice(max(0, i), max(0, j)), marks)
+
+
+    def reverse (self):
+        """reverse the marks in place"""
+
+        self[:] = self[::-1]
+
+
+    def sort (self, *args, **kwargs):
+        """sort the marks in place"""
+
+        marks = list(self)
+        marks.sort(*args, **kwargs)
+        self[:] = marks
+
+
+    def resize (self, *args):
+        """the board has a fixed size"""
+
+        raise TypeError("the board has a fixed size")
+
+
+    __delitem__ = __delslice__ = __iadd__ = __imul__ = append = extend = insert = pop = remove = resize
+
+
+    def set_mark (self, i, mark):
+        """set the mark in cell i, for a subclass to keep its own state up to date"""
+
+        list.__setitem__(self, i, mark)
+
+
+class SpanBoard (MarkBoard):
+    """a board as a list of marks, which keeps per-span counts of the X and O marks as cells get set"""
+
+    MARKS = ["X", "O"]
+
+
+    def __init__ (self, spans, cells):
+        """count the marks on each span, for a span table and the initial cells"""
+
+        list.__init__(self, cells)
+
+        self.spans = spans
+        self.other = dict(zip(self.MARKS, reversed(self.MARKS)))
+        self.counts = dict([(mark, array.array("i", [0]) * spans.n_spans) for mark in self.MARKS])
+
+        # for each mark, the spans it could still complete, bucketed by
+        # its count on them -- with a heap per bucket to find the first
+        # span in the scan order, where entries get removed lazily
+
+        self.buckets = {}
+        self.heaps = {}
+
+        for mark in self.MARKS:
+            self.buckets[mark] = [set() for count in range(0, spans.span_length + 1)]
+            self.buckets[mark][0].update(range(0, spans.n_spans))
+            self.heaps[mark] = [[] for count in range(0, spans.span_length + 1)]
+            self.heaps[mark][0] = range(0, spans.n_spans)
+
+        for i, mark in enumerate(cells):
+            if mark in self.counts:
+                self.update(i, mark, 1)
+
+
+    def set_mark (self, i, mark):
+        """set the mark in a cell, updating the counts for the spans through it"""
+
+        old = self[i]
+
+        if old != mark:
+            list.__setitem__(self, i, mark)
+
+            if old in self.counts:
+                self.update(i, old, -1)
+
+            if mark in self.counts:
+                self.update(i, mark, 1)
+
+
+    def update (self, i, mark, delta):
+        """add or remove a mark in cell i, in O(spans through the cell)"""
+
+        other = self.other[mark]
+        mine = self.counts[mark]
+        theirs = self.counts[other]
+
+        for k in self.spans.spans_through(i):
+            before = mine[k]
+            mine[k] = before + delta
+
+            if theirs[k] == 0:
+                # the span stays playable for this mark, at a new count
+                self.shift(mark, k, before, before + delta)
+
+            if before == 0:
+                # a first mark blocks the span for the other one...
+                self.shift(other, k, theirs[k], None)
+            elif before + delta == 0:
+                # ...and removing the last mark frees it again
+                self.shift(other, k, None, theirs[k])
+
+
+    def shift (self, mark, k, old, new):
+        """move span k between the buckets for a mark, where None means not playable"""
+
+        if old is not None:
+            self.buckets[mark][old].discard(k)
+
+        if new is not None:
+            bucket = self.buckets[mark][new]
+            heap = self.heaps[mark][new]
+            bucket.add(k)
+
+            if len(heap) > 2 * len(bucket) + 32:
+                # drop the stale entries
+                heap[:] = sorted(bucket)
+            else:
+                heapq.heappush(heap, k)
+
+
+    def won (self, mark):
+        """test whether a mark has completed any span"""
+
+        return len(self.buckets[mark][self.spans.span_length]) > 0
+
+
+    def best (self, mark):
+        """the highest count of a mark among its playable spans, with the first such span, or None"""
+
+        for count in range(self.spans.span_length, -1, -1):
+            bucket = self.buckets[mark][count]
+
+            if bucket:
+                heap = self.heaps[mark][count]
+
+                while heap[0] not in bucket:
+                    heapq.heappop(heap)
+
+                return count, heap[0]
+
+        return None
+
+
+class BitBoard (MarkBoard):
+    """a board as a list of marks, which also keeps the cells of the X and O marks as integer bitmasks"""
+
+    MARKS = ["X", "O"]
+
+
+    def __init__ (self, spans, cells):
+        """set the bits for the initial cells, given a span table"""
+
+        list.__init__(self, cells)
+
+        self.spans = spans
+        self.other = dict(zip(self.MARKS, reversed(self.MARKS)))
+        self.bits = dict([(mark, 0) for mark in self.MARKS])
+
+        for i, mark in enumerate(cells):
+            if mark in self.bits:
+                self.bits[mark] |= 1 << i
+
+
+    def set_mark (self, i, mark):
+        """set the mark in a cell, updating the bitmasks"""
+
+        old = self[i]
+        list.__setitem__(self, i, mark)
+
+        if old in self.bits:
+            self.bits[old] &= ~(1 << i)
+
+        if mark in self.bits:
+            self.bits[mark] |= 1 << i
+
+
+    def won (self, mark):
+        """test whether a mark has completed any span"""
+
+        bits = self.bits[mark]
+
+        for mask in self.spans.masks:
+            if bits & mask == mask:
+                return True
+
+        return False
+
+
+    def best (self, mark):
+        """the highest count of a mark among its playable spans, with the first such span, or None"""
+
+        bits = self.bits[mark]
+        blocked = self.bits[self.other[mark]]
+        best_count = -1
+        best_k = None
+
+        for k, mask in enumerate(self.spans.masks):
+            if not (blocked & mask):
+                count = bin(bits & mask).count("1")
+
+                if count > best_count:
+                    best_count = count
+                    best_k = k
+
+                    if count == self.spans.span_length:
+                        break
+
+        if best_k is None:
+            return None
+
+        return best_count, best_k
 
 
 class T3_UI:
@@ -168,6 +782,459 @@ class T3_AI:
         return you_win, game_over, stimulus_ai
 
 
+class SearchTimeout (Exception):
+    """raised when a search runs out of its time budget"""
+
+    pass
+
+
+class SearchAI (T3_AI):
+    """AI which chooses its move by iterative-deepening alpha-beta search, with a transposition table"""
+
+    TIME_BUDGET = 0.1
+    MARGIN = 0.1
+    TABLE_SIZE = 1 << 16
+    MAX_MOVES = 12
+    NEAR = 2
+
+    WIN = 1000000
+    EXACT, LOWER, UPPER = range(0, 3)
+
+    # random keys per (board size, mark, cell), plus one for O to move,
+    # shared by every search -- keyed by the marks rather than the sides,
+    # so the table stays valid when the player searched for alternates
+
+    _zobrist = {}
+    _near = {}
+
+
+    def __init__ (self, time_budget=None, table_size=None, cache_size=None):
+        """set the time budget per move, the size of the transposition table, and the size of the position cache"""
+
+        # the search stops a fraction of the budget early, leaving time
+        # to unwind and play the move
+
+        self.time_budget = time_budget or self.TIME_BUDGET
+        self.margin = self.MARGIN * self.time_budget
+        self.table = [None] * (table_size or self.TABLE_SIZE)
+        self.generation = 0
+        self.cache_size = cache_size
+        self.cache = None
+        self.value = None
+
+        # statistics for the last search, where pruned means some moves
+        # never got searched, so its result is not exact
+
+        self.nodes = 0
+        self.probes = 0
+        self.hits = 0
+        self.depth = 0
+        self.pruned = False
+
+
+    def ai_takes_turn (self, best_you_count, best_you_marks, best_you_span, other, t3):
+        """search for the AI's move, then play it"""
+
+        move = self.search(other, t3)
+
+        if move is None:
+            return True, t3.stalemate_text
+
+        t3.board[move] = other
+        t3.logger.debug(str(("SEARCH", other, move, self.depth, self.nodes)))
+
+        if t3.get_best_span(other)[0] == t3.span_length:
+            # AI wins the game
+            return True, t3.describe_move(move, t3.ai_wins_text)
+        elif t3.BLANK not in t3.board:
+            # no moves left
+            return True, " ".join((t3.describe_move(move, t3.ai_puts_text), t3.stalemate_text))
+        else:
+            return False, t3.describe_move(move, t3.ai_puts_text)
+
+
+    def setup (self, player, t3):
+        """load the board into the search state, with side 0 as the player to move"""
+
+        spans = t3.spans
+        size = t3.max_index
+
+        if size not in self._zobrist:
+            rng = random.Random(size)
+            self._zobrist[size] = ([[rng.getrandbits(64) for i in range(0, size)] for mark in range(0, 2)], rng.getrandbits(64))
+
+            near = []
+
+            for i in range(0, size):
+                x, y = t3.index2xy(i)
+                near.append([t3.xy2index(x + dx, y + dy) for dy in range(-self.NEAR, self.NEAR + 1) for dx in range(-self.NEAR, self.NEAR + 1)
+                             if (dx or dy) and (0 <= x + dx < t3.board_size) and (0 <= y + dy < t3.board_size)])
+
+            self._near[size] = near
+
+        keys, self.turn_key = self._zobrist[size]
+        self.zobrist = keys if player == t3.X_MARK else keys[::-1]
+        self.near = self._near[size]
+        self.span_length = spans.span_length
+        self.through = [spans.spans_through(i).tolist() for i in range(0, size)]
+        self.weights = [0] + [8 ** c for c in range(1, spans.span_length + 1)]
+        self.order_weights = [8 ** c for c in range(0, spans.span_length + 1)]
+
+        self.counts = [[0] * spans.n_spans, [0] * spans.n_spans]
+        self.cells = [None] * size
+        self.n_blank = size
+        self.marked = []
+        self.deltas = []
+        self.hash = 0
+        self.score = 0
+
+        for i, mark in enumerate(t3.board):
+            if mark == player:
+                self.place(i, 0)
+            elif mark != t3.BLANK:
+                self.place(i, 1)
+
+        # each mark placed here flipped the side to move, so set it to the player's
+
+        if (len(self.marked) % 2 == 1) != (player == t3.O_MARK):
+            self.hash ^= self.turn_key
+
+
+    def place (self, i, side):
+        """put a mark for a side in cell i, returning True if it completes a span"""
+
+        mine = self.counts[side]
+        theirs = self.counts[1 - side]
+        weights = self.weights
+        won = False
+        delta = 0
+
+        for k in self.through[i]:
+            c = mine[k]
+            t = theirs[k]
+
+            if t == 0:
+                # the span stays open for this side, at a higher count
+                delta += weights[c + 1] - weights[c]
+
+                if c + 1 == self.span_length:
+                    won = True
+            elif c == 0:
+                # the span gets blocked for the other side
+                delta += weights[t]
+
+            mine[k] = c + 1
+
+        if side == 1:
+            delta = -delta
+
+        self.score += delta
+        self.deltas.append(delta)
+        self.cells[i] = side
+        self.n_blank -= 1
+        self.marked.append(i)
+        self.hash ^= self.zobrist[side][i] ^ self.turn_key
+
+        return won
+
+
+    def unplace (self, i, side):
+        """take back the last mark"""
+
+        mine = self.counts[side]
+
+        for k in self.through[i]:
+            mine[k] -= 1
+
+        self.score -= self.deltas.pop()
+        self.cells[i] = None
+        self.n_blank += 1
+        self.marked.pop()
+        self.hash ^= self.zobrist[side][i] ^ self.turn_key
+
+
+    def ordered_moves (self, side, first=None, limit=None):
+        """candidate moves near the marks already played, best first by their span scores"""
+
+        cells = self.cells
+
+        if self.marked:
+            candidates = set([j for i in self.marked for j in self.near[i] if cells[j] is None])
+        else:
+            candidates = [i for i in range(0, len(cells)) if cells[i] is None]
+
+        mine = self.counts[side]
+        theirs = self.counts[1 - side]
+        weights = self.order_weights
+        scored = []
+
+        for i in candidates:
+            value = 0
+
+            for k in self.through[i]:
+                if theirs[k] == 0:
+                    # attack
+                    value += weights[mine[k]]
+
+                if mine[k] == 0:
+                    # defense
+                    value += weights[theirs[k]]
+
+            scored.append((-value, i))
+
+        moves = [i for value, i in sorted(scored)[:limit or self.MAX_MOVES]]
+
+        if (first is not None) and (first in candidates):
+            if first in moves:
+                moves.remove(first)
+
+            moves.insert(0, first)
+
+        if len(moves) < self.n_blank:
+            self.pruned = True
+
+        return moves
+
+
+    def negamax (self, depth, alpha, beta, side, ply):
+        """alpha-beta search, returning the value for the side to move"""
+
+        self.nodes += 1
+
+        # NB: the clock is cheap next to a node's move ordering, so check it every node
+
+        if time.time() > self.deadline:
+            raise SearchTimeout()
+
+        if self.n_blank == 0:
+            return 0
+
+        if depth == 0:
+            return self.score if side == 0 else -self.score
+
+        alpha0 = alpha
+        slot = self.hash % len(self.table)
+        entry = self.table[slot]
+        first = None
+        self.probes += 1
+
+        if (entry is not None) and (entry[0] == self.hash):
+            self.hits += 1
+            first = entry[4]
+
+            if entry[1] >= depth:
+                value, flag = entry[2], entry[3]
+
+                if flag == self.EXACT:
+                    return value
+                elif flag == self.LOWER:
+                    alpha = max(alpha, value)
+                else:
+                    beta = min(beta, value)
+
+                if alpha >= beta:
+                    return value
+
+        best = -self.WIN - 1
+        best_move = None
+
+        for i in self.ordered_moves(side, first):
+            if self.place(i, side):
+                value = self.WIN - ply
+            else:
+                value = -self.negamax(depth - 1, -beta, -alpha, 1 - side, ply + 1)
+
+            self.unplace(i, side)
+
+            if value > best:
+                best = value
+                best_move = i
+
+            if best > alpha:
+                alpha = best
+
+            if alpha >= beta:
+                break
+
+        if best_move is None:
+            return 0
+
+        if best <= alpha0:
+            flag = self.UPPER
+        elif best >= beta:
+            flag = self.LOWER
+        else:
+            flag = self.EXACT
+
+        # replace an entry from an earlier move, a different position
+        # searched less deeply, or the same position
+
+        if (entry is None) or (entry[5] != self.generation) or (entry[0] == self.hash) or (entry[1] <= depth):
+            self.table[slot] = (self.hash, depth, best, flag, best_move, self.generation)
+
+        return best
+
+
+    def search (self, player, t3):
+        """choose a move for the player within the time budget, or None if there are no moves"""
+
+        self.deadline = time.time() + self.time_budget - self.margin
+        self.nodes = 0
+        self.probes = 0
+        self.hits = 0
+        self.depth = 0
+        self.pruned = False
+
+        if (self.cache is None) or (self.cache.sym.board_size != t3.board_size):
+            self.cache = PositionCache(symmetries(t3.board_size), self.cache_size)
+
+        # a rotation or reflection of a position already solved gets its
+        # answer from the cache, mapped back to this orientation
+
+        cached = self.cache.get(t3.board, player)
+
+        if cached is not None:
+            best_move, self.value = cached
+            return best_move
+
+        self.setup(player, t3)
+        self.generation += 1
+        self.value = None
+
+        moves = self.ordered_moves(0, limit=2 * self.MAX_MOVES)
+
+        if not moves:
+            return None
+
+        best_move = moves[0]
+        solved = False
+
+        for depth in range(1, self.n_blank + 1):
+            alpha = -self.WIN - 1
+            move = None
+
+            try:
+                for i in moves:
+                    if self.place(i, 0):
+                        value = self.WIN
+                    else:
+                        value = -self.negamax(depth - 1, -self.WIN - 1, -alpha, 1, 1)
+
+                    self.unplace(i, 0)
+
+                    if value > alpha:
+                        alpha = value
+                        move = i
+            except SearchTimeout:
+                break
+
+            best_move = move
+            self.value = alpha
+            self.depth = depth
+
+            # search the best move first at the next depth, and stop once the game is decided
+
+            moves.remove(move)
+            moves.insert(0, move)
+
+            if (abs(alpha) > self.WIN - t3.max_index) or (depth == self.n_blank):
+                solved = True
+                break
+
+        # NB: only a completed search over every move goes into the cache,
+        # since the result of a search cut off by its deadline depends on
+        # timing, and one which skipped moves may have missed a better one
+
+        if solved and not self.pruned:
+            self.cache.put(t3.board, player, best_move, self.value)
+
+        return best_move
+
+
+class TestSearchAI (unittest.TestCase):
+    """unit tests for the search AI"""
+
+    def test_win_and_block (self):
+        """the search takes a win when it can, and otherwise blocks one"""
+
+        t3 = TicTacToe(ai_class=SearchAI)
+        t3.board = ['O', 'X', ' ', 'X', 'O', ' ', ' ', ' ', ' ']
+        you_win, game_over, stimulus = t3.player_takes_turn(6, 'X', 'O')
+
+        self.assertTrue(game_over and not you_win)
+        self.assertEqual(t3.board[8], 'O')
+
+        t3 = TicTacToe(ai_class=SearchAI)
+        t3.board = ['X', ' ', ' ', ' ', 'O', ' ', ' ', ' ', ' ']
+        you_win, game_over, stimulus = t3.player_takes_turn(1, 'X', 'O')
+
+        self.assertFalse(game_over)
+        self.assertEqual(t3.board[2], 'O')
+
+
+    def test_draw (self):
+        """two search AIs draw on a 3x3 board"""
+
+        t3 = TicTacToe(ai_class=SearchAI)
+        marks = [t3.X_MARK, t3.O_MARK]
+
+        for n in range(0, 9):
+            t3.board[t3.ai.search(marks[n % 2], t3)] = marks[n % 2]
+            self.assertNotEqual(t3.get_best_span(marks[n % 2])[0], 3)
+
+
+    def test_alternating_players (self):
+        """the same position hashes alike from either root player, so table entries carry over between searches"""
+
+        t3 = TicTacToe(ai_class=SearchAI)
+        ai = t3.ai
+        t3.board = ['X', ' ', ' ', ' ', 'O', ' ', ' ', ' ', ' ']
+
+        ai.setup(t3.X_MARK, t3)
+        ai.place(8, 0)
+        x_root = ai.hash
+
+        t3.board[8] = t3.X_MARK
+        ai.setup(t3.O_MARK, t3)
+
+        self.assertEqual(ai.hash, x_root)
+
+        ai.setup(t3.X_MARK, t3)
+
+        self.assertNotEqual(ai.hash, x_root)
+
+        # O searches with an extra mark, then gets a position it loses,
+        # which the table must not mistake for one it wins
+
+        t3.board = [' ', 'O', 'X', 'O', ' ', ' ', ' ', ' ', 'X']
+        ai.search(t3.O_MARK, t3)
+
+        t3.board = [' ', ' ', 'X', 'O', ' ', ' ', ' ', ' ', 'X']
+        ai.search(t3.O_MARK, t3)
+
+        fresh = SearchAI()
+        fresh.search(t3.O_MARK, t3)
+
+        self.assertTrue(fresh.value < 0)
+        self.assertEqual(ai.value, fresh.value)
+
+
+    def test_budget (self):
+        """a move on a 15x15 board stays within the time budget"""
+
+        t3 = TicTacToe(board_size=15, span_length=5, ai_class=SearchAI)
+
+        for i in [112, 113, 98, 128]:
+            t3.board[i] = [t3.X_MARK, t3.O_MARK][i % 2]
+
+        t0 = time.time()
+        move = t3.ai.search(t3.O_MARK, t3)
+
+        self.assertTrue(t3.board[move] == t3.BLANK)
+        self.assertTrue(time.time() - t0 < SearchAI.TIME_BUDGET)
+        self.assertTrue(t3.ai.depth >= 1)
+
+
 class TicTacToe:
     """represents the game board for tic-tac-toe"""
 
@@ -177,8 +1244,8 @@ class TicTacToe:
     O_MARK = "O"
 
 
-    def __init__ (self, board_size=3, span_length=3, ui_class=T3_UI, ai_class=T3_AI, log_file="t3.log", log_level=logging.WARNING):
-        """set board dimensions, rules of play, UI, AI, logging, text descriptions, etc., for the game"""
+    def __init__ (self, board_size=3, span_length=3, ui_class=T3_UI, ai_class=T3_AI, log_file="t3.log", log_level=logging.WARNING, board_class=SpanBoard):
+        """set board dimensions, rules of play, UI, AI, board engine, logging, text descriptions, etc., for the game"""
 
         self.board_size = board_size
         self.span_length = span_length
@@ -186,7 +1253,9 @@ class TicTacToe:
         self.ai = ai_class()
 
         self.max_index = self.board_size ** 2
-        self.board = map(lambda x: self.BLANK, range(0, self.max_index))
+        self.spans = span_table(self.board_size, self.span_length)
+        self.board_class = board_class
+        self.board = board_class(self.spans, [self.BLANK] * self.max_index)
         self.moves = map(lambda x: str(x + 1), range(0, self.max_index))
 
         # set up logging
@@ -293,33 +1362,22 @@ class TicTacToe:
     def describe_move (self, move, text_template):
         """format text to describe a move on the board"""
 
-        return text_template % self.positions[move]
+        if move < len(self.positions):
+            return text_template % self.positions[move]
+        else:
+            return text_template % ("square %d" % (move + 1))
 
 
     def generate_spans (self):
         """generator for possible spans of moves on the board"""
 
-        for i in range(0, self.max_index):
-            for transform in [(1, 0), (0, 1), (1, 1), (1, -1)]:
-                # attempt each of four possible transforms to collect a span
-                x, y = self.index2xy(i)
-                span = [i]
-
-                for j in range(1, self.span_length):
-                    # apply next step in the (x, y) transform
-                    x += transform[0]
-                    y += transform[1]
-
-                    if (x >= 0) and (x < self.board_size) and (y >= 0) and (y < self.board_size):
-                        # collect this index into the current span
-                        i_trans = self.xy2index(x, y)
+        # NB: the spans come from a table shared by every board of the
+        # same dimensions, instead of getting recomputed for each query
 
-                        if i_trans < self.max_index:
-                            span.append(i_trans)
+        spans = self.spans
 
-                            if len(span) == self.span_length:
-                                # success, a valid span
-                                yield span
+        for k in xrange(0, spans.n_spans):
+            yield spans.span(k).tolist()
 
 
     def generate_scores (self, player):
@@ -346,8 +1404,36 @@ class TicTacToe:
                 yield (mark_count, mark_span, span)
 
 
+    def sync_board (self):
+        """count the spans of the board, if it got replaced by a plain list"""
+
+        if not isinstance(self.board, self.board_class) or (self.board.spans is not self.spans):
+            self.board = self.board_class(self.spans, self.board)
+
+        return self.board
+
+
     def get_best_span (self, player):
-        """find the best span for a given player"""
+        """find the best span for a given player, from the per-span counters"""
+
+        board = self.sync_board()
+
+        if player not in board.MARKS:
+            return self.scan_best_span(player)
+
+        best = board.best(player)
+
+        if best is None:
+            return 0, None, None
+
+        count, k = best
+        span = self.spans.span(k).tolist()
+
+        return count, [[board[i] for i in span]], [span]
+
+
+    def scan_best_span (self, player):
+        """find the best span for a given player, by scanning every span of the board"""
 
         best_count = 0
         best_marks = None
@@ -371,7 +1457,7 @@ class TicTacToe:
     def player_takes_turn (self, move, player, other):
         """play one turn in the game"""
 
-        self.board[move] = player
+        self.sync_board()[move] = player
         you_win, game_over, stimulus_ai = self.ai.analyze_board(player, other, self)
 
         # prepare a message to prompt the next turn, if any
@@ -0,0 +1,529 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+# by Liber 118
+# http://liber118.com/
+# licensed under a Creative Commons Attribution-ShareAlike 3.0 Unported License
+# http://creativecommons.org/licenses/by-sa/3.0/
+
+
+import json
+import sys
+import unittest
+
+import numpy as np
+
+import pygame
+
+
+######################################################################
+## batched dice rolls
+
+_table_cache = {}
+
+def make_rng (seed=None):
+    """
+    create a seedable generator for the batched rolls
+    """
+
+    return np.random.RandomState(seed)
+
+
+def dice_tables (dice):
+    """
+    convert the per-face lookup table of a compiled Dice into arrays
+    """
+
+    tables = _table_cache.get(dice.notation)
+
+    if tables is None:
+        values = np.array(dice.values, dtype=np.float64)
+        accepted = np.array(dice.accepted, dtype=np.bool_)
+        tables = (values, accepted)
+        _table_cache[dice.notation] = tables
+
+    return tables
+
+
+def roll_faces (dice, n, rng):
+    """
+    draw N faces of the die, uniform over 0..die_count as with randint()
+    """
+
+    return rng.randint(0, dice.die_count + 1, size=n)
+
+
+def roll_batch (dice, n, rng):
+    """
+    roll a compiled Dice N times, returning (value, accepted) arrays
+    """
+
+    values, accepted = dice_tables(dice)
+    faces = roll_faces(dice, n, rng)
+
+    return values[faces], accepted[faces]
+
+
+
+######################################################################
+## lockstep simulation engine
+
+def py_round (x):
+    """
+    round half away from zero, like the builtin round() in Python 2
+    """
+
+    return np.sign(x) * np.floor(np.abs(x) + 0.5)
+
+
+class Population:
+    """
+    representation for K games played in lockstep, as struct-of-arrays
+
+    counters for each player are columns indexed [player, game], and
+    each turn the rules of the Card and Condition classes get applied
+    as array operations over the games which are still active
+    """
+
+    PLAYERS = ["player0", "player1"]
+    FOUNDER = 0
+    FELLOWS = 1
+
+    END_CONDITIONS = ["overwhelmed opponents", "stalemate", "status quo", "both ran out of cards"]
+
+    OVERWHELMED = 0
+    STALEMATE = 1
+    STATUS_QUO = 2
+
+
+    def __init__ (self, scenario, size, rng):
+        """
+        initialize K games from a Scenario or the path of a scenario config
+        """
+
+        if isinstance(scenario, basestring):
+            scenario = pygame.load_scenario(scenario)
+
+        conf = scenario.conf
+
+        self.size = size
+        self.rng = rng
+
+        self.max_turns = conf["max_turns"]
+        self.len_stalemate = conf["len_stalemate"]
+        self.n_turn = 1
+
+        self.side = [conf[p]["side"] for p in self.PLAYERS]
+        self.index = [conf[p]["index"] for p in self.PLAYERS]
+
+        shape = (len(self.PLAYERS), size)
+        init_force = [sum([hex["force"][i] for hex in conf["map"].values()]) for i in self.index]
+
+        self.init_force = np.array(init_force, dtype=np.float64)
+        self.n_forces = np.repeat(self.init_force[:, None], size, axis=1)
+        self.n_deployed = self.n_forces.copy()
+        self.n_captive = np.zeros(shape)
+        self.n_reserve = np.zeros(shape)
+        self.n_casualty = np.zeros(shape)
+        self.rage = np.array([[conf[p]["rage"]] * size for p in self.PLAYERS], dtype=np.float64)
+
+        # per-turn log events, and count of turns without log events,
+        # which is what PreventDraw needs from the log
+
+        self.events = np.zeros(shape, dtype=np.bool_)
+        self.n_quiet = np.zeros(shape, dtype=np.int32)
+
+        # whether the window of recent states which PreventDraw shares
+        # per game has been emptied, cf. game.last_full_meta
+
+        self.window_empty = np.zeros(size, dtype=np.bool_)
+
+        # cards, as counts per card in the deck for each game
+
+        self.cards = []
+        self.retry = []
+        self.deck = []
+        self.conditions = []
+
+        for p in self.PLAYERS:
+            # NB: the arrays hold no forces per hex, so a card which moves
+            # forces on the map (and logs an event when it does) cannot
+            # be played in lockstep with the same results as the scalar engine
+
+            for c in conf[p]["cards"] + conf[p]["conditions"]:
+                if (c["kind"] not in self.CARD_OPS) and (c["kind"] not in self.CONDITION_OPS):
+                    raise ValueError("the lockstep engine does not support %s" % c["kind"])
+
+            cards = conf[p]["cards"]
+            self.cards.append([(self.CARD_OPS[c["kind"]], pygame.compile_dice(c["dice"])) for c in cards])
+            self.retry.append(np.array([c["retry"] in [True, "True"] for c in cards], dtype=np.bool_))
+            self.deck.append(np.repeat(np.array([[c["num"] for c in cards]], dtype=np.int32), size, axis=0))
+            self.conditions.append([(self.CONDITION_OPS[c["kind"]], pygame.compile_dice(c["dice"])) for c in conf[p]["conditions"]])
+
+        # outcomes
+
+        self.active = np.ones(size, dtype=np.bool_)
+        self.winner = np.zeros(size, dtype=np.int8) - 1
+        self.end = np.zeros(size, dtype=np.int8) - 1
+        self.margin = np.zeros(size, dtype=np.int32)
+        self.end_turn = np.zeros(size, dtype=np.int32)
+
+
+    def live (self, idx):
+        """
+        filter an index of games down to those still active
+        """
+
+        return idx[self.active[idx]]
+
+
+    def roll (self, dice, idx):
+        """
+        roll dice for the indexed games, keeping only the accepted rolls
+        """
+
+        values, accepted = roll_batch(dice, len(idx), self.rng)
+
+        return idx[accepted], values[accepted]
+
+
+    def game_over (self, winner, condition, idx):
+        """
+        winning condition retires the indexed games from the active mask
+        """
+
+        idx = self.live(idx)
+        loser = 1 - winner
+
+        self.winner[idx] = winner
+        self.end[idx] = condition
+        self.margin[idx] = (self.n_forces[winner, idx] - self.n_forces[loser, idx]).astype(np.int32)
+        self.end_turn[idx] = self.n_turn
+        self.active[idx] = False
+
+
+    def log_event (self, p, idx):
+        self.events[p, idx] = True
+
+
+    def add_forces (self, p, idx, delta):
+        keep = self.active[idx] & (delta != 0.0)
+        idx = idx[keep]
+        delta = delta[keep]
+
+        over = (self.n_forces[p, idx] + delta) <= 0
+        self.game_over(1 - p, self.OVERWHELMED, idx[over])
+        self.n_forces[p, idx[~over]] += delta[~over]
+
+
+    def add_captive (self, p, idx, delta):
+        keep = self.active[idx] & (delta != 0.0)
+        self.n_captive[p, idx[keep]] += delta[keep]
+
+
+    def calc_reserve (self, p, idx):
+        MIN_RESERVE = 2.0
+        RESERVE_RATIO = 0.05
+
+        return py_round(np.maximum(MIN_RESERVE, self.n_captive[p, idx] * RESERVE_RATIO))
+
+
+    ## card rules, cf. the execute() method of each Card class
+
+    def force_reduction (self, dice, us, them, idx):
+        idx, roll = self.roll(dice, idx)
+        delta = py_round(roll * self.n_deployed[us, idx])
+
+        rage = self.rage[us, idx] > 0.5
+
+        if rage.any():
+            REDUCE_FACTOR = 5.0
+            casualty = py_round(roll / REDUCE_FACTOR * delta) * rage
+
+            delta -= casualty
+            self.log_event(them, idx[rage])
+            self.n_casualty[them, idx] += casualty
+
+        self.log_event(them, idx)
+        self.add_captive(us, idx, delta)
+        self.add_forces(them, idx, -delta)
+
+
+    def insurrection (self, dice, us, them, idx):
+        idx, roll = self.roll(dice, idx)
+        delta = py_round(roll * self.n_captive[them, idx])
+
+        INSURRECT_FACTOR = 10.0
+        keep = delta > (self.init_force[them] / INSURRECT_FACTOR)
+        idx = idx[keep]
+        delta = delta[keep]
+
+        self.log_event(them, idx)
+        self.add_captive(them, idx, -delta)
+        self.add_forces(us, idx, delta)
+
+
+    def conversion (self, dice, us, them, idx):
+        idx, roll = self.roll(dice, idx)
+        delta = py_round(roll * self.n_forces[them, idx])
+
+        self.log_event(them, idx)
+        self.add_forces(them, idx, -delta)
+        self.add_forces(us, idx, delta)
+
+
+    def seriously_weird (self, dice, us, them, idx):
+        idx, roll = self.roll(dice, idx)
+        delta = py_round(roll * self.n_forces[them, idx])
+
+        self.log_event(them, idx)
+        self.add_forces(them, idx, -delta)
+
+
+    def winning_play (self, dice, us, them, idx):
+        pass
+
+
+    ## condition rules, cf. the execute() method of each Condition class
+
+    def prevent_draw (self, dice, us, them, idx):
+        # NB: the window starts with two None sentinels and keeps its
+        # first len_stalemate entries, so only with len_stalemate 0 can
+        # it match: the first check which passes empties it, for every
+        # player's PreventDraw, then every later check matches
+        empty = self.window_empty[idx]
+        self.game_over(them, self.STALEMATE, idx[empty])
+        idx = idx[~empty]
+
+        n_quiet = self.n_quiet[:, idx] + ~self.events[:, idx]
+        stalemate = (n_quiet > self.len_stalemate).any(axis=0)
+        self.game_over(them, self.STALEMATE, idx[stalemate])
+
+        if self.len_stalemate == 0:
+            self.window_empty[self.live(idx)] = True
+
+
+    def simulate_jail (self, dice, us, them, idx):
+        n_reserve = self.calc_reserve(us, idx)
+        short = n_reserve > self.n_forces[us, idx]
+
+        rolled, roll = self.roll(dice, idx[short])
+        delta = py_round(roll * self.n_captive[us, rolled])
+
+        self.log_event(us, rolled)
+        self.add_captive(us, rolled, -delta)
+        self.add_forces(them, rolled, delta)
+
+        self.update_reserve(us, idx, n_reserve)
+
+
+    def simulate_hospital (self, dice, us, them, idx):
+        n_reserve = self.calc_reserve(us, idx)
+        self.rage[them, idx] = 0.0
+        short = n_reserve > self.n_forces[us, idx]
+
+        rolled, roll = self.roll(dice, idx[short])
+
+        self.log_event(us, rolled)
+        self.rage[them, rolled] += 0.2
+
+        self.update_reserve(us, idx, n_reserve)
+
+
+    def update_reserve (self, us, idx, n_reserve):
+        keep = self.active[idx]
+        idx = idx[keep]
+
+        self.n_reserve[us, idx] = np.minimum(n_reserve[keep], self.n_forces[us, idx])
+        self.n_deployed[us, idx] = self.n_forces[us, idx] - self.n_reserve[us, idx]
+
+
+    CARD_OPS = {
+        "ForceReductionCard": force_reduction,
+        "InsurrectionCard": insurrection,
+        "ConversionCard": conversion,
+        "SeriouslyWeirdCard": seriously_weird,
+        "WinningPlayCard": winning_play,
+        }
+
+    CONDITION_OPS = {
+        "PreventDraw": prevent_draw,
+        "SimulateJail": simulate_jail,
+        "SimulateHospital": simulate_hospital,
+        }
+
+
+    def play_cards (self, p):
+        """
+        each active game with cards left draws one card for the player, and executes it
+        """
+
+        deck = self.deck[p]
+        total = deck.sum(axis=1)
+        idx = np.flatnonzero(self.active & (total > 0))
+
+        if len(idx) > 0:
+            # weighted by the count of each card left in the deck, as
+            # with random.choice() over a list of duplicate references
+            cum = deck[idx].cumsum(axis=1)
+            pick = np.floor(self.rng.random_sample(len(idx)) * total[idx])
+            choice = (cum <= pick[:, None]).sum(axis=1)
+
+            consumed = ~self.retry[p][choice]
+            deck[idx[consumed], choice[consumed]] -= 1
+
+            for j, (op, dice) in enumerate(self.cards[p]):
+                chosen = self.live(idx[choice == j])
+
+                if len(chosen) > 0:
+                    op(self, dice, p, 1 - p, chosen)
+
+
+    def test_conditions (self, p):
+        for op, dice in self.conditions[p]:
+            idx = np.flatnonzero(self.active)
+            op(self, dice, p, 1 - p, idx)
+
+
+    def play_turn (self):
+        """
+        advance all of the active games by one turn
+        """
+
+        if self.n_turn > self.max_turns:
+            # conclude the games still active
+            self.game_over(self.FELLOWS, self.STATUS_QUO, np.flatnonzero(self.active))
+            return
+
+        self.events[:] = False
+
+        self.play_cards(self.FOUNDER)
+        self.play_cards(self.FELLOWS)
+
+        self.test_conditions(self.FELLOWS)
+        self.test_conditions(self.FOUNDER)
+
+        self.n_quiet += ~self.events
+        self.n_turn += 1
+
+
+    def run (self):
+        """
+        play all of the games until each one ends
+        """
+
+        while self.active.any():
+            self.play_turn()
+
+        return self
+
+
+    def report (self):
+        """
+        summary statistics for the population, in the same terms as Simulation
+        """
+
+        win_tally = dict([(self.index[p], int((self.winner == p).sum())) for p in range(0, len(self.PLAYERS))])
+        end_tally = dict([(name, int((self.end == i).sum())) for i, name in enumerate(self.END_CONDITIONS) if (self.end == i).any()])
+
+        return { "games": self.size, "win_tally": win_tally, "end_tally": end_tally, "mean_turns": float(self.end_turn.mean()) }
+
+
+######################################################################
+## unit tests
+
+class TestRollBatch (unittest.TestCase):
+    """unit tests for batched dice rolls"""
+
+    def test_seeded (self):
+        """the same seed reproduces the same batch"""
+
+        dice = pygame.compile_dice("d10+1/20, >0")
+        v0, a0 = roll_batch(dice, 1000, make_rng(118))
+        v1, a1 = roll_batch(dice, 1000, make_rng(118))
+
+        self.assertTrue((v0 == v1).all() and (a0 == a1).all())
+
+
+    def test_table (self):
+        """every batched roll is a (value, accepted) pair from the scalar table"""
+
+        dice = pygame.compile_dice("d10/10, >1")
+        values, accepted = roll_batch(dice, 1000, make_rng(118))
+
+        for v, a in zip(values, accepted):
+            self.assertTrue((v, a) in dice.table)
+
+
+class TestPopulation (unittest.TestCase):
+    """unit tests for the lockstep simulation engine"""
+
+    def test_all_games_end (self):
+        """every game gets retired with a winner and an end condition"""
+
+        pop = Population("tboo.json", 2000, make_rng(118)).run()
+        report = pop.report()
+
+        self.assertFalse(pop.active.any())
+        self.assertEqual(sum(report["win_tally"].values()), 2000)
+        self.assertEqual(sum(report["end_tally"].values()), 2000)
+        self.assertTrue((pop.n_forces >= 0).all() and (pop.n_captive >= 0).all())
+
+
+    def test_unsupported (self):
+        """a scenario with a card the lockstep engine cannot play gets rejected"""
+
+        with open("tboo.json", "r") as f:
+            conf = json.load(f)
+
+        conf["player0"]["cards"].append({ "kind": "MovementCard", "event": "march", "dice": "d10/10, >0", "num": 1, "retry": "False" })
+
+        self.assertRaises(ValueError, Population, pygame.Scenario(conf), 10, make_rng(118))
+
+
+    def test_shared_window (self):
+        """with PreventDraw for both players and len_stalemate 0, both engines end every game in turn 1"""
+
+        with open("tboo.json", "r") as f:
+            conf = json.load(f)
+
+        conf["len_stalemate"] = 0
+        conf["player1"]["conditions"].append({ "kind": "PreventDraw", "dice": "d10, >0" })
+        scenario = pygame.Scenario(conf)
+
+        sim = pygame.Simulation(scenario, 2000, seed=118, events="off")
+        sim.simulate()
+        report = Population(scenario, 2000, make_rng(118)).run().report()
+
+        self.assertEqual(sim.stats.mean_turns(), 1.0)
+        self.assertEqual(report["mean_turns"], 1.0)
+
+        for index in ["0", "1"]:
+            self.assertTrue(abs(sim.stats.wins[index] - report["win_tally"][index]) < 100)
+
+        for condition, count in sim.stats.ends.items():
+            self.assertTrue(abs(count - report["end_tally"].get(condition, 0)) < 100)
+
+
+    def test_retry (self):
+        """a card retries for a JSON true as well as the string "True", as in the scalar engine"""
+
+        with open("tboo.json", "r") as f:
+            conf = json.load(f)
+
+        conf["player0"]["cards"][0]["retry"] = True
+        conf["player1"]["cards"][0]["retry"] = "True"
+        pop = Population(pygame.Scenario(conf), 10, make_rng(118))
+
+        self.assertTrue(pop.retry[0][0] and pop.retry[1][0])
+        self.assertFalse(pop.retry[0][1:].any())
+
+
+######################################################################
+## command line interface
+
+if __name__ == "__main__":
+    if (len(sys.argv) > 1) and (sys.argv[1] == "test"):
+        # run unit tests
+        del sys.argv[1]
+        unittest.main()